@@ -0,0 +1,135 @@
+'''
+Aho-Corasick 多模式匹配自动机：一次线性扫描找出输入中出现的所有模式串
+安装了 pyahocorasick（C 实现）时优先使用，否则使用下面的纯 Python 实现
+'''
+from array import array
+from collections import deque
+from typing import Dict, Iterable, List, Set, Tuple
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# 转移表的键为 (状态 << CHAR_BITS) | 字符码，Unicode 码点不超过 21 位
+CHAR_BITS = 21
+
+
+class AhoCorasick:
+    """
+    patterns 为 (pattern_id, pattern) 序列，同一模式串可以对应多个 id。
+    构建完成后只读，可以在多个协程/线程间共享。
+    backend 为 auto 时有 pyahocorasick 就用它，python 强制使用纯 Python 实现。
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[int, str]], backend='auto'):
+        # 同一模式串的 id 合并，每个模式串只插入一次
+        ids_by_pattern: Dict[str, List[int]] = {}
+        self.pattern_count = 0
+        self.max_pattern_length = 0
+        for pattern_id, pattern in patterns:
+            if not pattern:
+                continue
+            ids_by_pattern.setdefault(pattern, []).append(pattern_id)
+            self.pattern_count += 1
+            self.max_pattern_length = max(self.max_pattern_length, len(pattern))
+
+        self.backend = 'pyahocorasick' if backend == 'auto' and ahocorasick is not None else 'python'
+        if self.backend == 'pyahocorasick':
+            self._automaton = ahocorasick.Automaton()
+            for pattern, ids in ids_by_pattern.items():
+                self._automaton.add_word(pattern, tuple(ids))
+            if ids_by_pattern:
+                self._automaton.make_automaton()
+            return
+
+        # 纯 Python 实现：所有转移放在一个以整数为键的字典中，fail / 字典后缀链接用紧凑数组，
+        # 输出只为终止状态保存（绝大多数状态没有输出）
+        self._goto: Dict[int, int] = {}
+        self._children: List[List[int]] = [[]]  # 仅构建期间使用，构建完成后释放
+        self._state_count = 1
+        self._output: Dict[int, Tuple[int, ...]] = {}
+        for pattern, ids in ids_by_pattern.items():
+            self._add(pattern, tuple(ids))
+        self._fail = array('i', bytes(4 * self._state_count))
+        self._dict_link = array('i', bytes(4 * self._state_count))
+        self._build_links()
+        del self._children
+
+    def _add(self, pattern, ids):
+        goto = self._goto
+        state = 0
+        for ch in pattern:
+            key = (state << CHAR_BITS) | ord(ch)
+            nxt = goto.get(key)
+            if nxt is None:
+                nxt = self._state_count
+                self._state_count += 1
+                goto[key] = nxt
+                self._children[state].append(key)
+                self._children.append([])
+            state = nxt
+        self._output[state] = ids
+
+    def _build_links(self):
+        goto, fail, output, dict_link = self._goto, self._fail, self._output, self._dict_link
+        mask = (1 << CHAR_BITS) - 1
+        queue = deque(goto[key] for key in self._children[0])
+        while queue:
+            state = queue.popleft()
+            for key in self._children[state]:
+                nxt = goto[key]
+                queue.append(nxt)
+                code = key & mask
+                link = fail[state]
+                while link and ((link << CHAR_BITS) | code) not in goto:
+                    link = fail[link]
+                target = goto.get(code, 0) if link == 0 else goto[(link << CHAR_BITS) | code]
+                fail[nxt] = target if target != nxt else 0
+                link = fail[nxt]
+                dict_link[nxt] = link if link in output else dict_link[link]
+
+    def iter_matches(self, text: str):
+        """逐个产出 (结束位置, pattern_id)"""
+        if self.backend == 'pyahocorasick':
+            if self.pattern_count:
+                for end, ids in self._automaton.iter(text):
+                    for pattern_id in ids:
+                        yield end, pattern_id
+            return
+        goto, fail, output, dict_link = self._goto, self._fail, self._output, self._dict_link
+        state = 0
+        for pos, ch in enumerate(text):
+            code = ord(ch)
+            nxt = goto.get((state << CHAR_BITS) | code)
+            while nxt is None and state:
+                state = fail[state]
+                nxt = goto.get((state << CHAR_BITS) | code)
+            state = nxt or 0
+            node = state if state in output else dict_link[state]
+            while node:
+                for pattern_id in output[node]:
+                    yield pos, pattern_id
+                node = dict_link[node]
+
+    def search(self, text: str) -> Set[int]:
+        """返回 text 中出现过的所有 pattern_id"""
+        if self.backend == 'pyahocorasick':
+            return {pattern_id for _, pattern_id in self.iter_matches(text)}
+        goto, fail, output, dict_link = self._goto, self._fail, self._output, self._dict_link
+        found: Set[int] = set()
+        reported = set()  # 已输出过的状态，其字典后缀链上的输出也都已输出
+        state = 0
+        for ch in text:
+            code = ord(ch)
+            nxt = goto.get((state << CHAR_BITS) | code)
+            while nxt is None and state:
+                state = fail[state]
+                nxt = goto.get((state << CHAR_BITS) | code)
+            state = nxt or 0
+            node = state if state in output else dict_link[state]
+            while node and node not in reported:
+                reported.add(node)
+                found.update(output[node])
+                node = dict_link[node]
+        return found
@@ -0,0 +1,30 @@
+'''
+锚点 k-gram：为每个片段选出它在整个语料中出现最少的 k-gram 作为锚点。
+片段 a 被输入 b 包含时，a 的锚点一定是 b 的某个 k-gram，且 len(a) <= len(b)，
+查询时先用 (anchor_gram, code_len) 索引筛出少量候选，再对候选做 LIKE
+'''
+from collections import Counter
+from typing import Iterable, List, Optional
+
+
+def kgrams(code: str, k: int) -> List[str]:
+    """返回去重后的全部 k-gram（有序，便于作为数组参数）"""
+    if not code or len(code) < k:
+        return []
+    return sorted({code[i:i + k] for i in range(len(code) - k + 1)})
+
+
+def count_document_frequency(codes: Iterable[str], k: int) -> Counter:
+    """统计每个 k-gram 出现在多少个片段中"""
+    frequency = Counter()
+    for code in codes:
+        frequency.update(kgrams(code, k))
+    return frequency
+
+
+def choose_anchor(code: str, k: int, frequency: Counter) -> Optional[str]:
+    """取文档频率最低的 k-gram（并列时取字典序最小者）；短于 k 的片段没有锚点"""
+    grams = kgrams(code, k)
+    if not grams:
+        return None
+    return min(grams, key=lambda gram: (frequency.get(gram, 0), gram))
@@ -0,0 +1,160 @@
+'''
+本地近似最近邻索引（IVF-Flat），以可内存映射的 .npy 文件持久化
+多个 API worker 加载同一目录时共享同一份 page cache，冷启动只需 mmap
+'''
+import json
+import mmap
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from local_vector_index import _normalize, certainty_to_cosine, format_match
+
+INDEX_META_FILE = 'index_meta.json'
+
+
+# 分配倒排列表、写出重排后的向量时每次处理的行数
+CHUNK_ROWS = 65536
+
+
+def _assign(vectors, centroids, chunk_size=CHUNK_ROWS, normalize=False):
+    """把每个向量分配给余弦相似度最高的聚类中心；normalize 时逐块归一化（用于未归一化的 mmap 数据）"""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        if normalize:
+            chunk = _normalize(chunk)
+        labels[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(vectors, nlist, iterations=20, sample_size=100000, seed=0):
+    """
+    在采样数据上训练球面 k-means，返回归一化后的聚类中心。
+    vectors 可以是未归一化的 mmap 数组，只有采样部分会被读入内存并归一化
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = max(int(sample_size), nlist)
+    if len(vectors) > sample_size:
+        # 排序后按顺序读取，对 mmap 更友好
+        vectors = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    vectors = _normalize(vectors)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        # 空簇重新随机选点初始化
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def build_ivf_index(vectors, metadata, index_dir, nlist=0, iterations=20, sample_size=100000, seed=0):
+    """
+    构建 IVF-Flat 索引并写入 index_dir。
+    向量按倒排列表顺序连续存放，list_offsets[i]:list_offsets[i+1] 即第 i 个列表。
+    vectors 可以是 load_export(mmap=True) 返回的只读 mmap：训练只用采样，分配和写出都逐块进行，
+    不会把全部向量（及其归一化副本）同时读入内存。
+    """
+    count = len(vectors)
+    if count == 0:
+        raise ValueError("没有可用于构建索引的向量")
+    if not nlist:
+        nlist = int(4 * np.sqrt(count))
+    nlist = max(1, min(int(nlist), count))
+
+    centroids = train_centroids(vectors, nlist, iterations, sample_size, seed)
+    labels = _assign(vectors, centroids, normalize=True)
+    order = np.argsort(labels, kind='stable')
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(labels, minlength=nlist), out=offsets[1:])
+    del labels
+
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, 'centroids.npy'), centroids)
+    ordered = np.lib.format.open_memmap(
+        os.path.join(index_dir, 'vectors.npy'), mode='w+', dtype=np.float32, shape=(count, vectors.shape[1])
+    )
+    for start in range(0, count, CHUNK_ROWS):
+        ordered[start:start + CHUNK_ROWS] = _normalize(vectors[order[start:start + CHUNK_ROWS]])
+    ordered.flush()
+    del ordered
+    np.save(os.path.join(index_dir, 'list_offsets.npy'), offsets)
+
+    # 元数据按同样顺序写入 jsonl，并记录每行的字节偏移，检索时按需读取
+    line_offsets = np.zeros(count + 1, dtype=np.int64)
+    with open(os.path.join(index_dir, 'metadata.jsonl'), 'wb') as f:
+        for pos, idx in enumerate(order):
+            line = json.dumps(metadata[idx], ensure_ascii=False).encode('utf-8') + b'\n'
+            f.write(line)
+            line_offsets[pos + 1] = line_offsets[pos] + len(line)
+    np.save(os.path.join(index_dir, 'metadata_offsets.npy'), line_offsets)
+
+    with open(os.path.join(index_dir, INDEX_META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'type': 'ivf_flat', 'count': count, 'dim': int(vectors.shape[1]), 'nlist': nlist}, f)
+    return nlist
+
+
+class IVFIndex:
+    """
+    IVF-Flat 检索：先选 nprobe 个最近的倒排列表，再在列表内精确计算相似度。
+    nprobe 越大召回越高、延迟越大；nprobe == nlist 时等价于暴力检索。
+    """
+
+    def __init__(self, index_dir, nprobe=8):
+        with open(os.path.join(index_dir, INDEX_META_FILE), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.centroids = np.load(os.path.join(index_dir, 'centroids.npy'))
+        self.vectors = np.load(os.path.join(index_dir, 'vectors.npy'), mmap_mode='r')
+        self.list_offsets = np.load(os.path.join(index_dir, 'list_offsets.npy'))
+        self.metadata_offsets = np.load(os.path.join(index_dir, 'metadata_offsets.npy'), mmap_mode='r')
+        self._metadata_file = open(os.path.join(index_dir, 'metadata.jsonl'), 'rb')
+        self._metadata = mmap.mmap(self._metadata_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.nprobe = max(1, min(int(nprobe), len(self.centroids)))
+
+    def __len__(self):
+        return int(self.meta['count'])
+
+    def close(self):
+        self._metadata.close()
+        self._metadata_file.close()
+
+    def _get_metadata(self, pos):
+        start, end = int(self.metadata_offsets[pos]), int(self.metadata_offsets[pos + 1])
+        return json.loads(self._metadata[start:end])
+
+    def search(self, query_vectors, top_k, certainty=0.0, nprobe=None) -> List[List[Dict]]:
+        if len(query_vectors) == 0:
+            return []
+        queries = _normalize(np.asarray(query_vectors, dtype=np.float32))
+        nprobe = max(1, min(int(nprobe or self.nprobe), len(self.centroids)))
+        min_cosine = certainty_to_cosine(certainty)
+        centroid_scores = queries @ self.centroids.T
+        if nprobe < len(self.centroids):
+            probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.tile(np.arange(len(self.centroids)), (len(queries), 1))
+
+        results = []
+        for query, lists in zip(queries, probes):
+            candidates = np.concatenate([
+                np.arange(self.list_offsets[l], self.list_offsets[l + 1]) for l in lists
+            ])
+            if len(candidates) == 0:
+                results.append([])
+                continue
+            # 同一列表内的向量是连续存放的，这里按位置读取 mmap 中的数据
+            scores = self.vectors[candidates] @ query
+            k = min(int(top_k), len(candidates))
+            top = np.argpartition(-scores, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+            top = top[np.argsort(-scores[top])]
+            results.append([
+                format_match(self._get_metadata(int(candidates[i])), float(scores[i]))
+                for i in top if scores[i] >= min_cosine
+            ])
+        return results
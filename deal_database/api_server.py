@@ -5,11 +5,20 @@ from typing import List, Union, Dict, Any
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 import uvicorn
+import asyncpg
+
+from aho_corasick import AhoCorasick
+from suffix_index import SuffixIndex
+from result_cache import VersionedResultCache
+from parallel_scan import ParallelScanner
+from winnowing import fingerprint
+from anchor_gram import kgrams
 
 
 def get_db_config(yaml_file='settings.yaml') -> Dict[str, Any]:
@@ -31,6 +40,8 @@ def get_db_config(yaml_file='settings.yaml') -> Dict[str, Any]:
     
     return {
         "url": database_url,
+        # 直连 asyncpg 使用的 DSN（去掉 SQLAlchemy 的驱动前缀）
+        "dsn": database_url.replace("postgresql+asyncpg://", "postgresql://", 1),
         "table_name": db_config['table_name'],
         "pool_size": pool_config.get('min_connections', 4),
         "max_overflow": pool_config.get('max_connections', 10) - pool_config.get('min_connections', 4),
@@ -42,18 +53,409 @@ def get_db_config(yaml_file='settings.yaml') -> Dict[str, Any]:
 # 全局变量
 async_engine = None
 AsyncSessionLocal = None
+# fast_path 启用时的 asyncpg 连接池
+pg_pool = None
+
+RECORD_COLUMNS = "id, file_name, title, malicious_code, description, hash_str"
+
+# pg_trgm 只能为长度 >= 3 的模式提取三元组
+TRGM_MIN_LENGTH = 3
+
+# 超过该长度（字符数）的输入，其扫描、k-gram、指纹等计算放到线程中执行，避免阻塞事件循环
+INLINE_WORK_SIZE = 4096
+
+WHITESPACE_RE = re.compile(r'[\s\n]+')
+
+
+def normalize_code(code_str: str) -> str:
+    """去除所有空白字符，与数据库中的 format_code 保持一致"""
+    return WHITESPACE_RE.sub('', code_str)
+
+
+async def run_cpu_bound(fn, *args, size=0):
+    """size 达到 INLINE_WORK_SIZE 时在线程中执行 fn，很小的输入直接执行，省去线程切换"""
+    if size >= INLINE_WORK_SIZE:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+def like_escape(value: str) -> str:
+    """转义 LIKE 通配符，输入中的 % 和 _ 按字面匹配"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def build_search_sql(table_name, input_contains_db, db_contains_input, short_input=False, anchor_k=None):
+    """
+    按启用的匹配方向生成查询，两个方向用 UNION 组合，避免 OR 让规划器放弃索引。
+    "输入包含数据库代码" 方向启用锚点剪枝（anchor_k）时，先用 anchor_gram = ANY(输入的 k-gram)
+    和 code_len <= 输入长度 筛选候选，没有锚点的片段（短于 k 或尚未计算）单独一个分支；
+    "数据库代码包含输入" 方向写成 format_code LIKE :contains_pattern，可以走 pg_trgm GIN 索引；
+    输入短于 3 个字符时三元组索引无能为力，改用 strpos 顺序扫描。
+    """
+    selects = []
+    if input_contains_db and anchor_k:
+        # 数据库中的 format_code 是输入代码的子串 (b contains a)，只检查锚点出现在输入中的候选
+        selects.append(
+            f"SELECT {RECORD_COLUMNS} FROM {table_name} "
+            f"WHERE anchor_gram = ANY(CAST(:input_grams AS text[])) AND code_len <= :input_len "
+            f"AND :input_code LIKE CONCAT('%', format_code, '%')"
+        )
+        selects.append(
+            f"SELECT {RECORD_COLUMNS} FROM {table_name} "
+            f"WHERE anchor_gram IS NULL AND (code_len IS NULL OR code_len <= :input_len) "
+            f"AND :input_code LIKE CONCAT('%', format_code, '%')"
+        )
+    elif input_contains_db:
+        # 数据库中的 format_code 是输入代码的子串 (b contains a)
+        selects.append(f"SELECT {RECORD_COLUMNS} FROM {table_name} WHERE :input_code LIKE CONCAT('%', format_code, '%')")
+    if db_contains_input:
+        # 输入代码是数据库中 format_code 的子串 (a contains b)
+        if short_input:
+            selects.append(f"SELECT {RECORD_COLUMNS} FROM {table_name} WHERE strpos(format_code, :input_code) > 0")
+        else:
+            selects.append(f"SELECT {RECORD_COLUMNS} FROM {table_name} WHERE format_code LIKE :contains_pattern ESCAPE '\\'")
+    if not selects:
+        return None
+    return text("\nUNION\n".join(selects))
+
+
+def build_sql_params(cleaned_code, input_contains_db, db_contains_input, anchor_k=None):
+    """生成 build_search_sql 查询对应的参数"""
+    short_input = len(cleaned_code) < TRGM_MIN_LENGTH
+    params = {}
+    if input_contains_db or (db_contains_input and short_input):
+        params["input_code"] = cleaned_code
+    if input_contains_db and anchor_k:
+        params["input_grams"] = kgrams(cleaned_code, anchor_k)
+        params["input_len"] = len(cleaned_code)
+    if db_contains_input and not short_input:
+        params["contains_pattern"] = f"%{like_escape(cleaned_code)}%"
+    return params
+
+
+# 批量查询的数组参数，asyncpg 位置参数按此顺序编号
+BATCH_PARAM_ORDER = ("inputs", "patterns", "gram_ords", "grams")
+
+
+def build_batch_search_sql(table_name, input_contains_db, db_contains_input, asyncpg_style=False, anchor_k=None, short_inputs=False):
+    """
+    批量查询：所有输入作为数组参数 unnest 成带序号的临时关系，与表做一次 JOIN，
+    结果按序号拆回各个输入。每个匹配方向一个子查询，用 UNION 组合。
+    启用锚点剪枝时，所有输入的 k-gram 展开为 (序号, k-gram) 两个平行数组，先按 anchor_gram 等值连接出候选。
+    与 build_search_sql 一致，短于 3 个字符的输入不走 LIKE（pattern 为 NULL），
+    批次中有短输入（short_inputs）时额外加一个 strpos 分支只处理它们。
+    asyncpg_style 为 True 时返回 $1/$2... 位置参数的 SQL 字符串，供 asyncpg 直接执行。
+    """
+    columns = ", ".join(f"m.{column.strip()}" for column in RECORD_COLUMNS.split(","))
+    source = (
+        "unnest(CAST(:inputs AS text[]), CAST(:patterns AS text[])) "
+        "WITH ORDINALITY AS q(input_code, contains_pattern, ord)"
+    )
+    selects = []
+    if input_contains_db and anchor_k:
+        grams = "unnest(CAST(:gram_ords AS bigint[]), CAST(:grams AS text[])) AS g(ord, gram)"
+        selects.append(
+            f"SELECT q.ord, {columns} FROM {grams} "
+            f"JOIN {table_name} m ON m.anchor_gram = g.gram "
+            f"JOIN {source} ON q.ord = g.ord "
+            f"WHERE m.code_len <= char_length(q.input_code) AND q.input_code LIKE CONCAT('%', m.format_code, '%')"
+        )
+        selects.append(
+            f"SELECT q.ord, {columns} FROM {source} JOIN {table_name} m ON m.anchor_gram IS NULL "
+            f"AND (m.code_len IS NULL OR m.code_len <= char_length(q.input_code)) "
+            f"AND q.input_code LIKE CONCAT('%', m.format_code, '%')"
+        )
+    elif input_contains_db:
+        selects.append(f"SELECT q.ord, {columns} FROM {source} JOIN {table_name} m ON q.input_code LIKE CONCAT('%', m.format_code, '%')")
+    if db_contains_input:
+        selects.append(f"SELECT q.ord, {columns} FROM {source} JOIN {table_name} m ON m.format_code LIKE q.contains_pattern ESCAPE '\\'")
+        if short_inputs:
+            selects.append(
+                f"SELECT q.ord, {columns} FROM {source} JOIN {table_name} m "
+                f"ON q.contains_pattern IS NULL AND strpos(m.format_code, q.input_code) > 0"
+            )
+    if not selects:
+        return None
+    union_sql = "\nUNION\n".join(selects)
+    sql = f"SELECT * FROM ({union_sql}) AS r ORDER BY r.ord, r.id"
+    if asyncpg_style:
+        names = [name for name in BATCH_PARAM_ORDER if f":{name}" in sql]
+        for position, name in enumerate(names, start=1):
+            sql = sql.replace(f":{name}", f"${position}")
+        return sql
+    return text(sql)
+
+
+def build_batch_params(cleaned_codes, input_contains_db, anchor_k=None):
+    """生成 build_batch_search_sql 查询对应的参数，键的顺序与 BATCH_PARAM_ORDER 一致；短输入的 pattern 为 None"""
+    params = {
+        "inputs": cleaned_codes,
+        "patterns": [
+            f"%{like_escape(code)}%" if len(code) >= TRGM_MIN_LENGTH else None
+            for code in cleaned_codes
+        ],
+    }
+    if input_contains_db and anchor_k:
+        gram_ords, grams = [], []
+        for ord_, code in enumerate(cleaned_codes, start=1):
+            code_grams = kgrams(code, anchor_k)
+            gram_ords.extend([ord_] * len(code_grams))
+            grams.extend(code_grams)
+        params["gram_ords"] = gram_ords
+        params["grams"] = grams
+    return params
+
+
+async def fetch_rows_per_input(session, table_name, cleaned_codes, input_contains_db, db_contains_input, anchor_k=None):
+    """逐个输入执行查询，返回与输入顺序一致的行列表"""
+    sql_templates = {
+        short_input: build_search_sql(table_name, input_contains_db, db_contains_input, short_input, anchor_k)
+        for short_input in (False, True)
+    }
+    rows_per_input = []
+    for cleaned_code in cleaned_codes:
+        sql_template = sql_templates[len(cleaned_code) < TRGM_MIN_LENGTH]
+        if sql_template is None:
+            rows_per_input.append([])
+            continue
+        # 执行异步查询：查找所有与 cleaned_code 存在包含关系的记录
+        params = await run_cpu_bound(
+            build_sql_params, cleaned_code, input_contains_db, db_contains_input, anchor_k, size=len(cleaned_code)
+        )
+        result = await session.execute(sql_template, params)
+        rows_per_input.append(result.mappings().all())
+    return rows_per_input
+
+
+def has_short_input(cleaned_codes):
+    return any(len(code) < TRGM_MIN_LENGTH for code in cleaned_codes)
+
+
+async def fetch_rows_batch(session, table_name, cleaned_codes, input_contains_db, db_contains_input, anchor_k=None):
+    """一条 SQL 查询所有输入，返回与输入顺序一致的行列表"""
+    rows_per_input = [[] for _ in cleaned_codes]
+    sql_template = build_batch_search_sql(
+        table_name, input_contains_db, db_contains_input, anchor_k=anchor_k, short_inputs=has_short_input(cleaned_codes)
+    )
+    if sql_template is None or not cleaned_codes:
+        return rows_per_input
+    params = await run_cpu_bound(
+        build_batch_params, cleaned_codes, input_contains_db, anchor_k, size=sum(map(len, cleaned_codes))
+    )
+    result = await session.execute(sql_template, params)
+    for row in result.mappings().all():
+        row = dict(row)
+        # ord 从 1 开始
+        rows_per_input[row.pop('ord') - 1].append(row)
+    return rows_per_input
+
+
+async def fetch_rows_asyncpg(pool, table_name, cleaned_codes, input_contains_db, db_contains_input, anchor_k=None):
+    """
+    fast_path：绕过 SQLAlchemy 直接用 asyncpg 执行批量查询。
+    asyncpg 按 SQL 文本缓存每个连接上的预编译语句，同一连接只在第一次执行时 PREPARE。
+    """
+    rows_per_input = [[] for _ in cleaned_codes]
+    sql = build_batch_search_sql(
+        table_name, input_contains_db, db_contains_input, asyncpg_style=True, anchor_k=anchor_k,
+        short_inputs=has_short_input(cleaned_codes)
+    )
+    if sql is None or not cleaned_codes:
+        return rows_per_input
+    params = await run_cpu_bound(
+        build_batch_params, cleaned_codes, input_contains_db, anchor_k, size=sum(map(len, cleaned_codes))
+    )
+    async with pool.acquire() as conn:
+        records = await conn.fetch(sql, *params.values())
+    for record in records:
+        row = dict(record)
+        rows_per_input[row.pop('ord') - 1].append(row)
+    return rows_per_input
+
+
+class MemoryIndex:
+    """
+    内存索引快照：表记录 + 可选的 Aho-Corasick 自动机 + 可选的后缀数组，整体原子替换。
+    自动机负责 "输入包含数据库代码"（对应 :input_code LIKE CONCAT('%', format_code, '%')），
+    空的 format_code 不参与匹配（SQL 中它会匹配任意输入）；
+    后缀数组负责 "数据库代码包含输入"（对应 format_code LIKE CONCAT('%', :input_code, '%')）。
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], version=None, signature=None, use_automaton=True, suffix_index_dir=None, parallel_config=None):
+        # version 与结果缓存使用同一个表版本号；signature 用于判断磁盘上的后缀数组是否可用
+        self.version = version
+        self.signature = signature
+        self.records = {row['id']: {k: v for k, v in row.items() if k != 'format_code'} for row in rows}
+        self.automaton = None
+        self.suffix_index = None
+        self.scanner = None
+        self.parallel_min_size = None
+        if use_automaton:
+            patterns = [(row['id'], row['format_code']) for row in rows if row.get('format_code')]
+            self.automaton = AhoCorasick(patterns)
+            # 超大输入交给进程池分段扫描
+            if parallel_config and parallel_config.get('enabled', False):
+                self.scanner = ParallelScanner(
+                    patterns,
+                    workers=parallel_config.get('workers', 4),
+                    segment_size=parallel_config.get('segment_size', 262144)
+                )
+                self.parallel_min_size = parallel_config.get('min_input_size', 1048576)
+        if suffix_index_dir:
+            self.suffix_index = SuffixIndex.load_or_build(
+                suffix_index_dir,
+                lambda: ((row['id'], row['format_code']) for row in rows),
+                signature
+            )
+
+    def describe(self):
+        parts = [f"{len(self.records)} 条记录"]
+        if self.automaton is not None:
+            parts.append(f"自动机 {self.automaton.pattern_count} 个模式串")
+        if self.suffix_index is not None:
+            parts.append(f"后缀数组 {len(self.suffix_index)} 个片段")
+        return ", ".join(parts)
+
+    def contained_in(self, cleaned_code: str) -> List[Dict[str, Any]]:
+        """输入中包含的数据库片段"""
+        return [self.records[i] for i in sorted(self.automaton.search(cleaned_code))]
+
+    async def contained_in_async(self, cleaned_code: str) -> List[Dict[str, Any]]:
+        """超过 parallel_min_size 的输入在进程池中分段扫描，其余在线程中扫描（很小的输入直接扫描）"""
+        if self.scanner is None or len(cleaned_code) < self.parallel_min_size:
+            return await run_cpu_bound(self.contained_in, cleaned_code, size=len(cleaned_code))
+        try:
+            ids = await self.scanner.search(cleaned_code)
+        except RuntimeError:
+            # 快照已被替换、进程池已关闭时退回到线程中扫描
+            ids = await asyncio.to_thread(self.automaton.search, cleaned_code)
+        return [self.records[i] for i in sorted(ids)]
+
+    def close(self):
+        if self.scanner is not None:
+            self.scanner.close()
+
+    def containing(self, cleaned_code: str) -> List[Dict[str, Any]]:
+        """包含输入的数据库片段"""
+        return [self.records[i] for i in self.suffix_index.search(cleaned_code) if i in self.records]
+
+    async def containing_async(self, cleaned_code: str) -> List[Dict[str, Any]]:
+        return await run_cpu_bound(self.containing, cleaned_code, size=len(cleaned_code))
+
+
+async def fetch_table_signature(table_name):
+    """用 (行数, 最大 id) 判断表内容是否变化"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(text(f"SELECT COUNT(*), COALESCE(MAX(id), 0) FROM {table_name}"))
+        return tuple(result.one())
+
+
+async def fetch_anchor_columns_ready(table_name):
+    """检查加载脚本是否已为表添加 code_len / anchor_gram 剪枝列"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            text("SELECT COUNT(*) FROM information_schema.columns WHERE table_name = :name AND column_name IN ('code_len', 'anchor_gram')"),
+            {"name": table_name}
+        )
+        return result.scalar() == 2
+
+
+async def fingerprint_table_ready(session, table_name):
+    """指纹表是否已创建；存在后缓存结果，不再每次查询系统表"""
+    if not app.state.fingerprint_table_ready:
+        result = await session.execute(
+            text("SELECT to_regclass(:name) IS NOT NULL"), {"name": f"{table_name}_fingerprint"}
+        )
+        app.state.fingerprint_table_ready = bool(result.scalar())
+    return app.state.fingerprint_table_ready
+
+
+async def fetch_table_version(table_name):
+    """
+    读取加载脚本维护的表版本号（{table_name}_meta 中的 version），
+    元数据表不存在时退化为 (行数, 最大 id)
+    """
+    async with AsyncSessionLocal() as session:
+        meta_table = (await session.execute(text("SELECT to_regclass(:name)"), {"name": f"{table_name}_meta"})).scalar()
+        if meta_table is not None:
+            version = (await session.execute(text(f"SELECT value FROM {table_name}_meta WHERE key = 'version'"))).scalar()
+            return ('version', version or 0)
+    return await fetch_table_signature(table_name)
+
+
+async def refresh_result_cache_loop(app: FastAPI, interval: float):
+    """后台定期读取表版本号，版本变化时清空结果缓存，并立即唤醒内存索引的重建"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            version = await fetch_table_version(app.state.table_name)
+            if app.state.result_cache.set_version(version):
+                print(f"表版本变化，结果缓存已清空 (version={version})")
+                app.state.table_changed.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"读取表版本失败: {e}")
+
+
+async def build_memory_index(app: FastAPI) -> MemoryIndex:
+    """读取全表并在线程中构建内存索引，避免阻塞事件循环"""
+    table_name = app.state.table_name
+    # 先读版本号再读数据：期间若有新数据写入，索引内容只会比版本号新，下一轮检查时再重建
+    version = await fetch_table_version(table_name)
+    # 版本号在删表重建后会从头计数，磁盘上的后缀数组同时比对 (行数, 最大 id)
+    signature = list(version) + list(await fetch_table_signature(table_name))
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(text(f"SELECT {RECORD_COLUMNS}, format_code FROM {table_name}"))
+        rows = [dict(row) for row in result.mappings().all()]
+    return await asyncio.to_thread(
+        MemoryIndex,
+        rows,
+        version,
+        signature,
+        app.state.match_engine == 'aho_corasick',
+        app.state.suffix_index_dir if app.state.containment_engine == 'suffix_array' else None,
+        app.state.parallel_scan
+    )
+
+
+async def refresh_memory_index_loop(app: FastAPI, interval: float):
+    """
+    按表版本号（与结果缓存相同）检查表是否变化，变化时重建内存索引并原子替换。
+    结果缓存发现版本变化时会立即唤醒本循环，否则每 interval 秒检查一次
+    """
+    while True:
+        try:
+            await asyncio.wait_for(app.state.table_changed.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+        app.state.table_changed.clear()
+        try:
+            version = await fetch_table_version(app.state.table_name)
+            if app.state.memory_index is not None and version == app.state.memory_index.version:
+                continue
+            memory_index = await build_memory_index(app)
+            old_index, app.state.memory_index = app.state.memory_index, memory_index
+            if old_index is not None:
+                old_index.close()
+            print(f"内存索引已重建: {memory_index.describe()} (version={memory_index.version})")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"重建内存索引失败: {e}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     生命周期管理：初始化数据库连接池
     """
-    global async_engine, AsyncSessionLocal
+    global async_engine, AsyncSessionLocal, pg_pool
     
     # 读取配置
     config = get_db_config()
     table_name = config.pop("table_name")
     db_url = config.pop("url")
+    db_dsn = config.pop("dsn")
     
     # 创建异步引擎
     print("正在初始化数据库连接池...")
@@ -100,11 +502,84 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"读取匹配逻辑配置失败，使用默认值: {e}")
         app.state.match_logic = {'input_contains_db': True, 'db_contains_input': False}
+        full_config = {}
+
+    # 匹配引擎：sql 在数据库中逐行 LIKE；aho_corasick 在内存中一次扫描完成 "输入包含数据库代码" 的匹配
+    api_config = full_config.get('api_server', {})
+    app.state.match_engine = api_config.get('match_engine', 'sql')
+    # 包含匹配引擎：sql 走 pg_trgm 索引；suffix_array 用内存后缀数组完成 "数据库代码包含输入" 的匹配
+    app.state.containment_engine = api_config.get('containment_engine', 'sql')
+    app.state.suffix_index_dir = api_config.get('suffix_index_dir', 'output/suffix_index')
+    app.state.parallel_scan = api_config.get('parallel_scan', {})
+    app.state.memory_index = None
+    app.state.table_changed = asyncio.Event()
+    refresh_task = None
+    if app.state.match_engine == 'aho_corasick' or app.state.containment_engine == 'suffix_array':
+        app.state.memory_index = await build_memory_index(app)
+        print(f"内存索引已构建: {app.state.memory_index.describe()}")
+        refresh_interval = api_config.get('matcher_refresh_interval', 60)
+        if refresh_interval:
+            refresh_task = asyncio.create_task(refresh_memory_index_loop(app, refresh_interval))
+    print(f"匹配引擎: {app.state.match_engine}, 包含匹配引擎: {app.state.containment_engine}")
+
+    # winnowing 指纹近似匹配配置，k/window 与加载脚本共用 database.fingerprint
+    app.state.fingerprint_config = full_config.get('database', {}).get('fingerprint', {})
+    app.state.fuzzy_config = api_config.get('fuzzy_search', {})
+    # 指纹表由 get_in_database.py 创建，服务运行期间才建好也能被后续请求发现
+    app.state.fingerprint_table_ready = False
+
+    # 批量查询：一个请求的所有输入合并为一条 SQL
+    app.state.batch_query = api_config.get('batch_query', False)
+
+    # 锚点 k-gram 剪枝：k 与加载脚本共用 database.anchor_gram，表中没有剪枝列时不启用
+    anchor_config = full_config.get('database', {}).get('anchor_gram', {})
+    app.state.anchor_k = None
+    if anchor_config.get('enabled', False):
+        if await fetch_anchor_columns_ready(table_name):
+            app.state.anchor_k = anchor_config.get('k', 6)
+            print(f"锚点 k-gram 剪枝已启用 (k={app.state.anchor_k})")
+        else:
+            print("表中缺少 code_len/anchor_gram 列，锚点剪枝未启用，请重新运行 get_in_database.py")
+
+    # fast_path：/search 的 SQL 直接走 asyncpg 连接池，响应用字典构造，不经过 Pydantic 逐字段校验
+    app.state.fast_path = api_config.get('fast_path', False)
+    if app.state.fast_path:
+        pg_pool = await asyncpg.create_pool(
+            db_dsn,
+            min_size=config["pool_size"],
+            max_size=config["pool_size"] + config["max_overflow"],
+            max_inactive_connection_lifetime=config["pool_recycle"],
+            command_timeout=config["command_timeout"],
+            server_settings={"jit": "off"}
+        )
+        print(f"fast_path 已启用: asyncpg 连接池 ({config['pool_size']}-{config['pool_size'] + config['max_overflow']})")
+
+    # 结果缓存：热点输入不访问连接池，表版本变化时失效
+    cache_config = api_config.get('result_cache', {})
+    app.state.result_cache = None
+    cache_task = None
+    if cache_config.get('enabled', False):
+        app.state.result_cache = VersionedResultCache(cache_config.get('max_entries', 10000))
+        app.state.result_cache.set_version(await fetch_table_version(table_name))
+        cache_task = asyncio.create_task(
+            refresh_result_cache_loop(app, cache_config.get('version_poll_interval', 5))
+        )
+        print(f"结果缓存已启用 (version={app.state.result_cache.version})")
 
     print(f"数据库异步引擎已启动 (Table: {table_name}, Timeout: {config['command_timeout']}s, Pre-ping: ON)")
     
     yield
     
+    if refresh_task:
+        refresh_task.cancel()
+    if app.state.memory_index is not None:
+        app.state.memory_index.close()
+    if cache_task:
+        cache_task.cancel()
+    if pg_pool is not None:
+        await pg_pool.close()
+        pg_pool = None
+
     # 关闭引擎
     if async_engine:
         await async_engine.dispose()
@@ -163,6 +638,27 @@ class SearchResponse(BaseModel):
     data: List[ResultItemModel]
     count: int
 
+def make_search_response(state, message, data, fast_path=False):
+    """fast_path 下 data 为普通字典，直接序列化返回，跳过 response_model 校验"""
+    if fast_path:
+        return JSONResponse({"state": state, "message": message, "data": data, "count": len(data)})
+    return SearchResponse(state=state, message=message, data=data, count=len(data))
+
+class FuzzyRecordModel(RecordModel):
+    shared_fingerprints: int
+
+class FuzzyResultItemModel(BaseModel):
+    code_string: str
+    input_fingerprints: int
+    records: List[FuzzyRecordModel]
+    count: int
+
+class FuzzySearchResponse(BaseModel):
+    state: str
+    message: str
+    data: List[FuzzyResultItemModel]
+    count: int
+
 
 @app.post("/search", response_model=SearchResponse)
 async def search_malicious_code(
@@ -182,15 +678,14 @@ async def search_malicious_code(
         input_contains_db = match_logic.get('input_contains_db', True)
         db_contains_input = match_logic.get('db_contains_input', False)
 
-        conditions = []
-        if input_contains_db:
-            # 数据库中的 format_code 是输入代码的子串 (b contains a)
-            conditions.append(":input_code LIKE CONCAT('%', format_code, '%')")
-        if db_contains_input:
-            # 输入代码是数据库中 format_code 的子串 (a contains b)
-            conditions.append("format_code LIKE CONCAT('%', :input_code, '%')")
-        
-        if not conditions:
+        # 启用内存索引时，对应方向不再走 SQL
+        memory_index = app.state.memory_index
+        use_automaton = input_contains_db and memory_index is not None and memory_index.automaton is not None
+        use_suffix = db_contains_input and memory_index is not None and memory_index.suffix_index is not None
+
+        sql_input_contains_db = input_contains_db and not use_automaton
+        sql_db_contains_input = db_contains_input and not use_suffix
+        if not input_contains_db and not db_contains_input:
              return SearchResponse(
                 state='not_found',
                 message='未启用任何匹配逻辑',
@@ -198,26 +693,63 @@ async def search_malicious_code(
                 count=0
             )
 
-        where_clause = " OR ".join(conditions)
+        # 去除空格用于匹配，较大的输入放到线程中处理，避免阻塞事件循环
+        cleaned_codes = [
+            await run_cpu_bound(normalize_code, code_str, size=len(code_str))
+            for code_str in code_strings
+        ]
 
-        sql_template = text(f"""
-            SELECT id, file_name, title, malicious_code, description, hash_str
-            FROM {table_name}
-            WHERE {where_clause}
-        """)
+        # 先查结果缓存，只有未命中的输入才访问内存索引和数据库
+        result_cache = app.state.result_cache
+        rows_per_input = [None] * len(cleaned_codes)
+        if result_cache is not None:
+            cache_version = result_cache.version
+            cache_keys = [
+                result_cache.make_key(code, {'input_contains_db': input_contains_db, 'db_contains_input': db_contains_input})
+                for code in cleaned_codes
+            ]
+            rows_per_input = [result_cache.get(key) for key in cache_keys]
+        miss_indexes = [i for i, rows in enumerate(rows_per_input) if rows is None]
+        miss_codes = [cleaned_codes[i] for i in miss_indexes]
 
-        for code_str in code_strings:
-            # 去除空格用于匹配
-            cleaned_code = re.sub(r'[\s\n]+', '', code_str)
-            
-            # 执行异步查询：查找所有 format_code 是 cleaned_code 子串的记录
-            result = await session.execute(sql_template, {"input_code": cleaned_code})
-            
-            # 获取结果
-            rows = result.mappings().all()
-            
+        # 批量模式下所有输入只需一次 SQL 往返
+        fast_path = pg_pool is not None
+        sql_rows = [[] for _ in miss_codes]
+        if miss_codes and (sql_input_contains_db or sql_db_contains_input):
+            if fast_path:
+                sql_rows = await fetch_rows_asyncpg(
+                    pg_pool, table_name, miss_codes, sql_input_contains_db, sql_db_contains_input, app.state.anchor_k
+                )
+            else:
+                fetch_rows = fetch_rows_batch if app.state.batch_query else fetch_rows_per_input
+                sql_rows = await fetch_rows(
+                    session, table_name, miss_codes, sql_input_contains_db, sql_db_contains_input, app.state.anchor_k
+                )
+
+        for i, cleaned_code, db_rows in zip(miss_indexes, miss_codes, sql_rows):
+            rows = []
+            if use_automaton:
+                rows.extend(await memory_index.contained_in_async(cleaned_code))
+            if use_suffix:
+                rows.extend(await memory_index.containing_async(cleaned_code))
+            rows.extend(db_rows)
+            # 多个来源的结果按 id 去重
+            unique_rows = {}
+            for row in rows:
+                unique_rows.setdefault(row['id'], dict(row))
+            rows_per_input[i] = list(unique_rows.values())
+            # 查询期间版本已变化、或内存索引还未按新版本重建时，结果不写入缓存
+            if result_cache is not None and result_cache.version == cache_version and (
+                not (use_automaton or use_suffix) or memory_index.version == cache_version
+            ):
+                result_cache.put(cache_keys[i], rows_per_input[i])
+
+        for code_str, rows in zip(code_strings, rows_per_input):
             # 组装数据
-            if rows:
+            if rows and fast_path:
+                # 行字典的键与 RecordModel 字段一致，直接输出
+                all_results.append({"code_string": code_str, "records": rows, "count": len(rows)})
+            elif rows:
                 records = [
                     RecordModel(
                         id=row['id'],
@@ -237,22 +769,103 @@ async def search_malicious_code(
 
         # 构造最终响应
         if all_results:
-            return SearchResponse(
+            return make_search_response(
+                'success',
+                f'查询成功，找到 {len(all_results)} 个代码字符串的匹配数据',
+                all_results,
+                fast_path
+            )
+        else:
+            return make_search_response('not_found', '所有代码字符串均未找到匹配的恶意代码', [], fast_path)
+
+    except asyncio.TimeoutError:
+        # 捕获 asyncpg 的超时错误
+        print("Error: Database query timed out.")
+        raise HTTPException(status_code=504, detail="Database query timed out")
+    except (SQLAlchemyError, asyncpg.PostgresError) as e:
+        import traceback
+        print(f"Database Error: {e}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail="Database query error")
+    except Exception as e:
+        import traceback
+        print(f"Server Error: {e}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/fuzzy_search", response_model=FuzzySearchResponse)
+async def fuzzy_search_malicious_code(
+    request: SearchRequest,
+    session: AsyncSession = Depends(get_db)
+):
+    """
+    基于 winnowing 指纹的近似匹配：按共享指纹数排序返回候选片段，
+    能容忍变量改名、OCR 错字等局部差异
+    """
+    code_strings = [request.code_strings] if isinstance(request.code_strings, str) else request.code_strings
+    table_name = app.state.table_name
+    fingerprint_config = app.state.fingerprint_config
+    fuzzy_config = app.state.fuzzy_config
+    all_results = []
+
+    sql_template = text(f"""
+        SELECT {", ".join(f"m.{column.strip()}" for column in RECORD_COLUMNS.split(","))}, c.shared_fingerprints
+        FROM (
+            SELECT snippet_id, COUNT(*) AS shared_fingerprints
+            FROM {table_name}_fingerprint
+            WHERE hash = ANY(CAST(:hashes AS bigint[]))
+            GROUP BY snippet_id
+            HAVING COUNT(*) >= :min_shared
+            ORDER BY shared_fingerprints DESC
+            LIMIT :top_k
+        ) AS c
+        JOIN {table_name} m ON m.id = c.snippet_id
+        ORDER BY c.shared_fingerprints DESC, m.id
+    """)
+
+    try:
+        if not await fingerprint_table_ready(session, table_name):
+            raise HTTPException(
+                status_code=503,
+                detail=f"指纹表 {table_name}_fingerprint 尚未创建，请先运行 get_in_database.py（fingerprint.enabled 为 true）生成指纹"
+            )
+        for code_str in code_strings:
+            hashes = await run_cpu_bound(
+                fingerprint, code_str, fingerprint_config.get('k', 8), fingerprint_config.get('window', 4), size=len(code_str)
+            )
+            if not hashes:
+                continue
+            result = await session.execute(sql_template, {
+                "hashes": list(hashes),
+                "min_shared": fuzzy_config.get('min_shared', 2),
+                "top_k": fuzzy_config.get('top_k', 10),
+            })
+            rows = result.mappings().all()
+            if rows:
+                records = [FuzzyRecordModel(**row) for row in rows]
+                all_results.append(FuzzyResultItemModel(
+                    code_string=code_str,
+                    input_fingerprints=len(hashes),
+                    records=records,
+                    count=len(records)
+                ))
+
+        if all_results:
+            return FuzzySearchResponse(
                 state='success',
-                message=f'查询成功，找到 {len(all_results)} 个代码字符串的匹配数据',
+                message=f'查询成功，找到 {len(all_results)} 个代码字符串的近似匹配数据',
                 data=all_results,
                 count=len(all_results)
             )
-        else:
-            return SearchResponse(
-                state='not_found',
-                message='所有代码字符串均未找到匹配的恶意代码',
-                data=[],
-                count=0
-            )
+        return FuzzySearchResponse(
+            state='not_found',
+            message='所有代码字符串均未找到近似匹配的恶意代码',
+            data=[],
+            count=0
+        )
 
+    except HTTPException:
+        raise
     except asyncio.TimeoutError:
-        # 捕获 asyncpg 的超时错误
         print("Error: Database query timed out.")
         raise HTTPException(status_code=504, detail="Database query timed out")
     except SQLAlchemyError as e:
@@ -265,6 +878,13 @@ async def search_malicious_code(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/cache_stats")
+async def cache_stats():
+    """结果缓存命中率统计"""
+    result_cache = app.state.result_cache
+    return {"result_cache": result_cache.stats() if result_cache else None}
+
+
 if __name__ == "__main__":
     # 读取 API 服务器配置
     with open('settings.yaml', 'r', encoding='utf-8') as f:
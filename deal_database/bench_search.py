@@ -0,0 +1,123 @@
+'''
+对比 /search 的两条数据库路径：SQLAlchemy text() + mappings() + Pydantic 模型，与 asyncpg 直连 + 字典响应
+（需在项目根目录运行，与 api_server.py 一致读取 settings.yaml）
+'''
+import asyncio
+import json
+import random
+import statistics
+import time
+
+import asyncpg
+import yaml
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from api_server import (
+    get_db_config, fetch_rows_batch, fetch_rows_asyncpg,
+    normalize_code, RecordModel, ResultItemModel, SearchResponse
+)
+
+ROUNDS = 200  # 每条路径的请求次数
+WARMUP_ROUNDS = 20  # 预热次数（建立连接、预编译语句），不计入统计
+CODES_PER_REQUEST = 5  # 每个请求包含的代码字符串数
+SAMPLE_SIZE = 200  # 从表中抽样的代码片段数
+
+
+def build_requests(samples):
+    """每个请求由若干数据库片段前后拼接噪声构成，保证 "输入包含数据库代码" 方向有命中"""
+    rng = random.Random(0)
+    requests = []
+    for _ in range(ROUNDS + WARMUP_ROUNDS):
+        picked = rng.sample(samples, min(CODES_PER_REQUEST, len(samples)))
+        requests.append([f"int x = {rng.randint(0, 9999)};\n{code}\nreturn 0;" for code in picked])
+    return requests
+
+
+async def run_sqlalchemy(session_factory, table_name, match_logic, anchor_k, code_strings):
+    cleaned_codes = [normalize_code(code) for code in code_strings]
+    async with session_factory() as session:
+        rows_per_input = await fetch_rows_batch(
+            session, table_name, cleaned_codes,
+            match_logic.get('input_contains_db', True), match_logic.get('db_contains_input', False), anchor_k
+        )
+    data = [
+        ResultItemModel(code_string=code, records=[RecordModel(**row) for row in rows], count=len(rows))
+        for code, rows in zip(code_strings, rows_per_input) if rows
+    ]
+    return SearchResponse(state='success', message='', data=data, count=len(data)).model_dump_json()
+
+
+async def run_asyncpg(pool, table_name, match_logic, anchor_k, code_strings):
+    cleaned_codes = [normalize_code(code) for code in code_strings]
+    rows_per_input = await fetch_rows_asyncpg(
+        pool, table_name, cleaned_codes,
+        match_logic.get('input_contains_db', True), match_logic.get('db_contains_input', False), anchor_k
+    )
+    data = [
+        {"code_string": code, "records": rows, "count": len(rows)}
+        for code, rows in zip(code_strings, rows_per_input) if rows
+    ]
+    return json.dumps({"state": 'success', "message": '', "data": data, "count": len(data)})
+
+
+async def measure(name, fn, requests):
+    for code_strings in requests[:WARMUP_ROUNDS]:
+        await fn(code_strings)
+    latencies = []
+    start = time.perf_counter()
+    for code_strings in requests[WARMUP_ROUNDS:]:
+        t0 = time.perf_counter()
+        await fn(code_strings)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    total = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"{name:<12} 平均 {statistics.mean(latencies):.2f}ms, p50 {latencies[len(latencies) // 2]:.2f}ms, "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f}ms, {len(latencies) / total:.1f} req/s"
+    )
+
+
+async def main():
+    config = get_db_config()
+    with open('settings.yaml', 'r', encoding='utf-8') as f:
+        settings = yaml.safe_load(f)
+    match_logic = settings.get('api_server', {}).get('match_logic', {})
+    anchor_config = settings.get('database', {}).get('anchor_gram', {})
+    table_name = config['table_name']
+
+    engine = create_async_engine(config['url'], pool_size=config['pool_size'], connect_args={"server_settings": {"jit": "off"}})
+    session_factory = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
+    pool = await asyncpg.create_pool(config['dsn'], min_size=1, max_size=config['pool_size'], server_settings={"jit": "off"})
+
+    try:
+        async with session_factory() as session:
+            result = await session.execute(
+                text(f"SELECT malicious_code FROM {table_name} WHERE malicious_code <> '' ORDER BY random() LIMIT :n"),
+                {"n": SAMPLE_SIZE}
+            )
+            samples = [row[0] for row in result.all()]
+            # 与 api_server 一致：表中已有剪枝列时才使用锚点剪枝
+            columns = await session.execute(
+                text("SELECT COUNT(*) FROM information_schema.columns WHERE table_name = :name AND column_name IN ('code_len', 'anchor_gram')"),
+                {"name": table_name}
+            )
+            anchor_k = anchor_config.get('k', 6) if anchor_config.get('enabled', False) and columns.scalar() == 2 else None
+        if not samples:
+            print(f"表 {table_name} 中没有数据，无法测试")
+            return
+        requests = build_requests(samples)
+        print(
+            f"表 {table_name}: {len(samples)} 条样本, {ROUNDS} 次请求 x {CODES_PER_REQUEST} 个代码字符串, "
+            f"匹配逻辑 {match_logic}, 锚点剪枝 k={anchor_k}"
+        )
+
+        await measure("sqlalchemy", lambda codes: run_sqlalchemy(session_factory, table_name, match_logic, anchor_k, codes), requests)
+        await measure("asyncpg", lambda codes: run_asyncpg(pool, table_name, match_logic, anchor_k, codes), requests)
+    finally:
+        await pool.close()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+'''
+构建本地 ANN 索引：读取 export_weaviate_vectors.py 的导出结果（不存在或与 Weaviate 当前数据不一致时重新导出），生成 IVF 索引
+'''
+import weaviate
+import warnings
+import os
+import time
+import yaml
+from local_vector_index import export_weaviate, export_is_current, load_export
+from ann_index import build_ivf_index
+
+warnings.filterwarnings("ignore")
+
+def load_config(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+def resolve_path(project_root, path):
+    return path if os.path.isabs(path) else os.path.join(project_root, path)
+
+def main():
+    # 读取配置文件
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config = load_config(os.path.join(project_root, 'settings.yaml'))
+
+    vector_search_conf = config.get('vector_search', {})
+    export_dir = resolve_path(project_root, vector_search_conf.get('local_index', {}).get('export_dir', 'output/vector_export'))
+    ann_conf = vector_search_conf.get('ann_index', {})
+    index_dir = resolve_path(project_root, ann_conf.get('index_dir', 'output/ann_index'))
+
+    # 导出结果记录了对象数和最大更新时间，与 class 当前状态不一致时重新导出，避免用过期向量建索引
+    weaviate_config = config.get('weaviate', {})
+    weaviate_url = weaviate_config.get('url', 'http://localhost:8011')
+    class_name = weaviate_config.get('class_name', 'Security')
+    client = weaviate.Client(url=weaviate_url)
+    if export_is_current(client, class_name, export_dir):
+        print(f"Reusing export in {export_dir} (up to date with class '{class_name}')")
+    else:
+        print(f"Export missing or stale, exporting class '{class_name}' from {weaviate_url} to {export_dir} ...")
+        export_weaviate(client, class_name, export_dir)
+
+    # 向量以 mmap 方式读取，训练只用采样，分配和写出逐块进行
+    vectors, metadata = load_export(export_dir, mmap=True)
+    print(f"Building IVF index over {len(metadata)} vectors ...")
+    start = time.time()
+    nlist = build_ivf_index(
+        vectors,
+        metadata,
+        index_dir,
+        nlist=ann_conf.get('nlist', 0),
+        iterations=ann_conf.get('train_iterations', 20),
+        sample_size=ann_conf.get('train_sample', 100000)
+    )
+    print(f"IVF index built in {time.time() - start:.2f}s (nlist={nlist}), saved to {index_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+'''
+LLM 代码清洗结果缓存：按 原始代码+提示词版本+模型名 的哈希持久化到本地 SQLite
+'''
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# 每写入多少条做一次过期清理（读取时也会惰性检查过期）
+TTL_SWEEP_EVERY = 1000
+
+
+def prompt_version(prompt_template: str) -> str:
+    """提示词内容的短哈希，提示词一改旧缓存自然失效"""
+    return hashlib.sha256(prompt_template.encode('utf-8')).hexdigest()[:16]
+
+
+class CleanCache:
+    """
+    内容寻址的清洗结果缓存，支持 TTL 过期和条目数上限淘汰（按最近访问时间）。
+    条目数在内存中维护，写入时不再 COUNT(*) 扫表。
+    """
+
+    def __init__(self, disk_path, prompt_template, model_name, ttl_seconds=0, max_entries=100000):
+        self.prompt_version = prompt_version(prompt_template)
+        self.model_name = str(model_name)
+        self.ttl_seconds = max(0, int(ttl_seconds or 0))  # 0 表示永不过期
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._puts_since_sweep = 0
+        os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+        self._db = sqlite3.connect(disk_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS clean_cache (
+                key TEXT PRIMARY KEY,
+                cleaned TEXT,
+                created_at REAL,
+                accessed_at REAL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_clean_cache_accessed ON clean_cache(accessed_at)")
+        self._db.commit()
+        self._count = self._db.execute("SELECT COUNT(*) FROM clean_cache").fetchone()[0]
+        self._evict(sweep_expired=True)
+
+    def make_key(self, code: str) -> str:
+        raw = f"{self.model_name}\0{self.prompt_version}\0{code}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, code: str) -> Optional[str]:
+        key = self.make_key(code)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT cleaned, created_at FROM clean_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._count -= self._db.execute("DELETE FROM clean_cache WHERE key = ?", (key,)).rowcount
+                self._db.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE clean_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, code: str, cleaned: str):
+        key = self.make_key(code)
+        now = time.time()
+        with self._lock:
+            updated = self._db.execute(
+                "UPDATE clean_cache SET cleaned = ?, created_at = ?, accessed_at = ? WHERE key = ?",
+                (cleaned, now, now, key)
+            ).rowcount
+            if not updated:
+                self._db.execute(
+                    "INSERT INTO clean_cache (key, cleaned, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, cleaned, now, now)
+                )
+                self._count += 1
+            self._db.commit()
+            self._puts_since_sweep += 1
+            sweep_expired = self._puts_since_sweep >= TTL_SWEEP_EVERY
+        self._evict(sweep_expired)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self._count,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _evict(self, sweep_expired=False):
+        """超出条目上限时淘汰最久未访问的条目；sweep_expired 时顺带清理过期条目（需要扫表，定期执行）"""
+        with self._lock:
+            if sweep_expired and self.ttl_seconds:
+                self._count -= self._db.execute(
+                    "DELETE FROM clean_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+                ).rowcount
+                self._puts_since_sweep = 0
+            if self._count > self.max_entries:
+                self._count -= self._db.execute(
+                    "DELETE FROM clean_cache WHERE key IN "
+                    "(SELECT key FROM clean_cache ORDER BY accessed_at ASC LIMIT ?)",
+                    (self._count - self.max_entries,)
+                ).rowcount
+            self._db.commit()
@@ -0,0 +1,90 @@
+'''
+长代码分窗检索：按语句边界切分为重叠窗口，并把各窗口的检索结果聚合为一个排序列表
+'''
+from typing import Dict, List
+
+# 以这些字符结尾的行视为语句/代码块边界，优先在这里切分
+STATEMENT_ENDINGS = (';', '{', '}', ':')
+
+
+def split_code_windows(code: str, window_chars=1200, overlap_chars=200, max_windows=32) -> List[str]:
+    """
+    按行累积到 window_chars 个字符后在最近的语句边界切分，相邻窗口重叠约 overlap_chars 个字符。
+    超过 max_windows 时从全部窗口中等间隔抽取 max_windows 个（含首尾），保证延迟有上界，
+    同时让检索覆盖整段输入而不只是开头部分。
+    """
+    lines = [line for line in code.splitlines() if line.strip()]
+    if not lines:
+        return [code]
+    windows = []
+    start = 0
+    while start < len(lines):
+        size = 0
+        end = start
+        last_boundary = None
+        while end < len(lines) and (size < window_chars or end == start):
+            size += len(lines[end]) + 1
+            if lines[end].rstrip().endswith(STATEMENT_ENDINGS):
+                last_boundary = end + 1
+            end += 1
+        # 还有剩余内容时回退到最近的语句边界
+        if end < len(lines) and last_boundary is not None and last_boundary > start:
+            end = last_boundary
+        windows.append('\n'.join(lines[start:end]))
+        if end >= len(lines):
+            break
+        # 向前回退若干行作为重叠
+        next_start = end
+        overlap = 0
+        while next_start - 1 > start and overlap + len(lines[next_start - 1]) + 1 <= overlap_chars:
+            next_start -= 1
+            overlap += len(lines[next_start]) + 1
+        start = next_start
+    return spread_windows(windows, max_windows)
+
+
+def spread_windows(windows: List[str], max_windows: int) -> List[str]:
+    """窗口数超过上限时按固定步长抽样，首尾窗口总是保留"""
+    max_windows = max(1, max_windows)
+    if len(windows) <= max_windows:
+        return windows
+    if max_windows == 1:
+        return [windows[0]]
+    stride = (len(windows) - 1) / (max_windows - 1)
+    return [windows[round(i * stride)] for i in range(max_windows)]
+
+
+def _match_key(match: Dict):
+    additional = match.get('_additional') or {}
+    return additional.get('id') or (match.get('file_name'), match.get('title'), match.get('code'))
+
+
+def aggregate_window_matches(window_results: List[List[Dict]], top_k: int, mode='max') -> List[Dict]:
+    """
+    合并多个窗口的检索结果：同一片段取最高 certainty（max）或累加 certainty（sum）作为得分。
+    返回的记录保留得分最高窗口的 _additional，并附加 score 和 matched_windows。
+    """
+    merged = {}
+    for matches in window_results:
+        for match in matches:
+            key = _match_key(match)
+            certainty = (match.get('_additional') or {}).get('certainty') or 0.0
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = {'record': match, 'best': certainty, 'score': certainty, 'windows': 1}
+                continue
+            entry['windows'] += 1
+            entry['score'] = max(entry['score'], certainty) if mode == 'max' else entry['score'] + certainty
+            if certainty > entry['best']:
+                entry['best'] = certainty
+                entry['record'] = match
+
+    ranked = sorted(merged.values(), key=lambda e: (e['score'], e['best']), reverse=True)[:top_k]
+    results = []
+    for entry in ranked:
+        record = dict(entry['record'])
+        record['_additional'] = dict(record.get('_additional') or {})
+        record['_additional']['score'] = entry['score']
+        record['_additional']['matched_windows'] = entry['windows']
+        results.append(record)
+    return results
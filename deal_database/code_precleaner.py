@@ -0,0 +1,109 @@
+'''
+基于规则的反编译代码预清洗，以及决定是否需要 LLM 清洗的 token 预算策略
+主要针对 Ghidra 输出：局部变量声明、栈 cookie 检查、SEH 异常链设置。
+FUN_/DAT_ 等带地址的命名保持原样：Weaviate 中的向量由原始代码生成，查询端改写标识符会偏离入库向量
+'''
+import re
+from typing import Callable, Optional
+
+# 声明中允许的类型名：Ghidra 的 undefinedN/intN/uintN 等基本类型和常见 Windows 类型，其余情况一律视为语句
+DECLARATION_TYPES = (
+    r'undefined\d*|u?int\d*|u?int\d+_t|u?char|u?short|u?long(?:long)?|bool|byte|float|double|void|code|'
+    r'wchar_t|size_t|dword|qword|word|DWORD|QWORD|WORD|BYTE|BOOL|CHAR|WCHAR|LONG|ULONG|UINT|SIZE_T|'
+    r'HANDLE|HMODULE|HKEY|HINSTANCE|LPVOID|LPSTR|LPCSTR|LPWSTR|LPCWSTR'
+)
+
+# 函数开头的局部变量声明，如 "undefined4 local_270 [9];"、"ushort *puVar6;"、"struct _ctx *pcVar1;"
+DECLARATION_RE = re.compile(
+    r'^\s*(?:const\s+|unsigned\s+|signed\s+)*(?:struct\s+[A-Za-z_]\w*|(?:' + DECLARATION_TYPES + r'))'
+    r'(?:\s*\*+\s*|\s+)\**[A-Za-z_]\w*(?:\s*\[[^\]]*\])*\s*;\s*$'
+)
+
+# "return uVar1;"、"goto LAB_00401000;" 等控制流语句的形式与声明相同，必须排除
+CONTROL_FLOW_RE = re.compile(r'^\s*(?:return|goto|break|continue|case|else|do)\b')
+
+# 栈 cookie 的设置与检查
+STACK_COOKIE_RES = [
+    re.compile(r'^\s*\w+\s*=\s*DAT_[0-9a-fA-F]+\s*\^\s*\(\w+\)&stack0x[0-9a-fA-F]+\s*;\s*$'),
+    re.compile(r'^\s*_*security_check_cookie\w*\s*\(.*\)\s*;\s*$'),
+    re.compile(r'^\s*(?:return\s+)?@?_*security_check_cookie\w*.*;\s*$'),
+]
+
+# SEH 异常链设置与恢复
+EXCEPTION_LIST_RES = [
+    re.compile(r'^\s*\w+\s*=\s*ExceptionList\s*;\s*$'),
+    re.compile(r'^\s*ExceptionList\s*=\s*&?\w+\s*;\s*$'),
+    re.compile(r'^\s*\w+\s*=\s*&LAB_[0-9a-fA-F]+\s*;\s*$'),
+    re.compile(r'^\s*local_8\s*=\s*(?:0xffffffff|0xfffffffe|0xffffffffffffffff)\s*;\s*$'),
+]
+
+# Ghidra 注释，如 "/* WARNING: Removing unreachable block */"
+GHIDRA_COMMENT_RE = re.compile(r'/\*\s*WARNING:.*?\*/', re.DOTALL)
+
+
+def _strip_declarations(lines):
+    """只删除函数体开头连续的声明行，遇到第一条语句即停止"""
+    result = []
+    in_header = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped == '{':
+            in_header = True
+            result.append(line)
+            continue
+        if in_header:
+            if not stripped or (DECLARATION_RE.match(line) and not CONTROL_FLOW_RE.match(line)):
+                continue
+            in_header = False
+        result.append(line)
+    return result
+
+
+def preclean_code(code: str) -> str:
+    """
+    确定性的预清洗：去掉不影响语义的样板代码，返回压缩后的代码
+    """
+    code = GHIDRA_COMMENT_RE.sub('', code)
+    lines = _strip_declarations(code.splitlines())
+    boilerplate = STACK_COOKIE_RES + EXCEPTION_LIST_RES
+    lines = [line for line in lines if not any(pattern.match(line) for pattern in boilerplate)]
+    code = '\n'.join(line.rstrip() for line in lines)
+    # 合并多余空行
+    code = re.sub(r'\n\s*\n+', '\n', code)
+    return code.strip()
+
+
+def make_token_counter(embed_model) -> Optional[Callable[[str], int]]:
+    """用 embedding 模型自身的 tokenizer 计算 token 数，取不到 tokenizer 时返回 None"""
+    client = getattr(embed_model, '_client', None) or getattr(embed_model, 'client', None)
+    tokenizer = getattr(client, 'tokenizer', None)
+    if tokenizer is None:
+        return None
+
+    def count_tokens(text: str) -> int:
+        return len(tokenizer(text, add_special_tokens=False, truncation=False)['input_ids'])
+
+    return count_tokens
+
+
+class CleaningPolicy:
+    """
+    决定长代码的处理方式：先规则预清洗，仍超过 token 预算时才交给 LLM。
+    没有 tokenizer 时退化为按字符数判断。
+    """
+
+    def __init__(self, char_threshold=1200, token_budget=2048, count_tokens=None, preclean=True):
+        self.char_threshold = int(char_threshold)
+        self.token_budget = int(token_budget)
+        self.count_tokens = count_tokens
+        self.preclean = preclean
+
+    def prepare(self, code: str):
+        """返回 (处理后的代码, 是否仍需要 LLM 清洗)"""
+        if len(code) <= self.char_threshold:
+            return code, False
+        if self.preclean:
+            code = preclean_code(code)
+        if self.count_tokens is not None:
+            return code, self.count_tokens(code) > self.token_budget
+        return code, len(code) > self.char_threshold
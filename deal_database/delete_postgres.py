@@ -2,6 +2,7 @@ import psycopg2  # 如果你是GraalPy环境，记得换成 import pg8000.dbapi
 import yaml
 import sys
 import os
+from get_in_database import create_meta_table, bump_table_version
 
 def get_db_config(yaml_file='settings.yaml'):
     """从配置文件读取数据库配置"""
@@ -35,6 +36,9 @@ def delete_by_file_name(conn, table_name, file_name):
         print(f"找到 {count} 条匹配记录")
         cur.execute(f"DELETE FROM {table_name} WHERE file_name = %s;", (file_name,))
         deleted_count = cur.rowcount
+        # 递增表版本号，使 API 的结果缓存失效
+        create_meta_table(cur, table_name)
+        bump_table_version(cur, table_name)
         conn.commit()
         print(f"成功删除 {deleted_count} 条数据")
         cur.close()
@@ -48,7 +52,9 @@ def truncate_table(conn, table_name):
         cur = conn.cursor()
         # DROP TABLE 会完全删除表
         print("正在执行 DROP TABLE 操作...")
+        cur.execute(f"DROP TABLE IF EXISTS {table_name}_fingerprint;")
         cur.execute(f"DROP TABLE IF EXISTS {table_name};")
+        cur.execute(f"DROP TABLE IF EXISTS {table_name}_meta;")
         conn.commit()
         print(f"表 {table_name} 已删除")
         cur.close()
@@ -0,0 +1,171 @@
+'''
+查询向量化微批调度器：把并发请求的查询合并成一次批量 encode
+以及按 token 长度分桶的批量向量化（查询和录入共用）
+'''
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """取不到 tokenizer 时按约 4 个字符一个 token 估算"""
+    return len(text) // 4 + 1
+
+
+def plan_token_batches(lengths: List[int], token_budget: int, max_batch_size: int = 0) -> List[List[int]]:
+    """
+    按 token 长度升序切分批次。同一批内补齐到最长文本，代价约为 最长长度 * 条数，
+    每批不超过 token_budget（单条超出预算时独占一批），条数不超过 max_batch_size（0 表示不限）。
+    返回原始下标的分组
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    current = []
+    for i in order:
+        # 升序遍历，新加入的文本就是批内最长的
+        longest = max(1, lengths[i])
+        if current and (longest * (len(current) + 1) > token_budget or (max_batch_size and len(current) >= max_batch_size)):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def embed_in_token_batches(
+    embed_fn: Callable[[List[str]], List[List[float]]],
+    texts: List[str],
+    count_tokens: Optional[Callable[[str], int]] = None,
+    token_budget: int = 0,
+    max_seq_length: Optional[int] = None,
+    max_batch_size: int = 0
+) -> List[List[float]]:
+    """
+    长度相近的文本放在同一批调用 embed_fn，减少补齐浪费；结果按输入顺序返回。
+    token_budget 为 0 时直接整体调用 embed_fn
+    """
+    if not texts or not token_budget:
+        return embed_fn(texts) if texts else []
+    count_tokens = count_tokens or estimate_tokens
+    lengths = []
+    for text in texts:
+        # 加上 [CLS]/[SEP]，超过 max_seq_length 的部分会被截断
+        length = count_tokens(text or '') + 2
+        lengths.append(min(length, max_seq_length) if max_seq_length else length)
+    vectors = [None] * len(texts)
+    for group in plan_token_batches(lengths, token_budget, max_batch_size):
+        for i, vector in zip(group, embed_fn([texts[i] for i in group])):
+            vectors[i] = vector
+    return vectors
+
+
+class EmbeddingBatcher:
+    """
+    将多个并发请求的 embed 调用合并为一次 embed_documents。
+    设置 token_budget 时，合并后的文本再按 token 长度分桶编码。
+    每个调用者拿到的仍然是自己那部分向量，顺序与输入一致。
+    """
+
+    def __init__(self, embed_model, max_batch_size=64, max_wait_ms=10, count_tokens=None, token_budget=0, max_seq_length=None):
+        self.embed_model = embed_model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.count_tokens = count_tokens
+        self.token_budget = int(token_budget or 0)
+        self.max_seq_length = max_seq_length
+        self._queue = queue.Queue()
+        self._pending = None  # 上一轮因超出批大小而留到下一轮的请求
+        self._stopped = threading.Event()
+        # 关闭检查与入队在同一把锁内完成，保证结束标记之后不会再有请求入队
+        self._submit_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        """提交一组文本，返回一个 Future，结果为对应的向量列表"""
+        future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+        with self._submit_lock:
+            if self._stopped.is_set():
+                future.set_exception(RuntimeError("EmbeddingBatcher has been closed"))
+                return future
+            self._queue.put((list(texts), future))
+        return future
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """阻塞式接口，供同步的 FastAPI 路由（运行在线程池中）调用"""
+        return self.submit(texts).result()
+
+    def close(self):
+        with self._submit_lock:
+            self._stopped.set()
+            self._queue.put(None)
+        self._worker.join(timeout=5)
+
+    def _collect(self):
+        """收集一批请求：凑满 max_batch_size 条文本，或等到 max_wait 超时"""
+        if self._pending is not None:
+            first, self._pending = self._pending, None
+        else:
+            first = self._queue.get()
+            if first is None:
+                return None
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopped.set()
+                break
+            # 单个请求不拆分，放不下就留给下一批
+            if size + len(item[0]) > self.max_batch_size:
+                self._pending = item
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+            all_texts = [text for texts, _ in batch for text in texts]
+            try:
+                vectors = embed_in_token_batches(
+                    self.embed_model.embed_documents,
+                    all_texts,
+                    self.count_tokens,
+                    self.token_budget,
+                    self.max_seq_length
+                )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                offset = 0
+                for texts, future in batch:
+                    future.set_result(vectors[offset:offset + len(texts)])
+                    offset += len(texts)
+            if self._stopped.is_set() and self._pending is None and self._queue.empty():
+                break
+        # 关闭后仍留在队列中的请求直接失败，避免调用者永久阻塞
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(RuntimeError("EmbeddingBatcher has been closed"))
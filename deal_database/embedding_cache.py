@@ -0,0 +1,143 @@
+'''
+查询向量缓存：内存 LRU + 可选的 SQLite 磁盘层（重启后仍然有效）
+'''
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    按 (模型, max_seq_length, 清洗后文本) 的哈希缓存向量。
+    命中内存层直接返回；未命中再查磁盘层，磁盘命中会回填内存层。
+    向量以只读的 float32 数组保存（768 维约 3 KB，Python float 列表约 24 KB）。
+    磁盘层最多保留 max_disk_entries 条，超出后按写入顺序淘汰最早的条目；
+    一次 embed 调用中新算出的向量在同一个事务中写入。
+    """
+
+    def __init__(self, model_id, max_seq_length, max_entries=10000, disk_path=None, max_disk_entries=200000):
+        self.model_id = str(model_id)
+        self.max_seq_length = int(max_seq_length)
+        self.max_entries = max(0, int(max_entries))
+        self.max_disk_entries = max(1, int(max_disk_entries))
+        self._disk_count = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embedding_cache (key TEXT PRIMARY KEY, vector BLOB)")
+            self._db.commit()
+            # 启动时统计一次条目数，之后随写入和淘汰维护，不再每次 COUNT(*)
+            self._disk_count = self._db.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            self._evict_disk()
+
+    def make_key(self, text: str) -> str:
+        raw = f"{self.model_id}\0{self.max_seq_length}\0{text}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self.make_key(text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embedding_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = _as_vector(np.frombuffer(row[0], dtype=np.float32))
+                    self._remember(key, vector)
+                    self.hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector):
+        self.put_many([(text, vector)])
+
+    def put_many(self, items: Iterable[Tuple[str, List[float]]]):
+        """写入多条向量，磁盘层只提交一次"""
+        rows = []
+        with self._lock:
+            for text, vector in items:
+                key = self.make_key(text)
+                vector = _as_vector(vector)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes()))
+            if self._db is None or not rows:
+                return
+            for row in rows:
+                cursor = self._db.execute("INSERT OR IGNORE INTO embedding_cache (key, vector) VALUES (?, ?)", row)
+                self._disk_count += cursor.rowcount
+            self._evict_disk()
+            self._db.commit()
+
+    def embed(self, texts: List[str], embed_fn: Callable[[List[str]], List[List[float]]]) -> List[np.ndarray]:
+        """只对未命中的文本调用 embed_fn，结果（float32 数组）按输入顺序返回"""
+        vectors = [self.get(text) for text in texts]
+        missing = {}
+        for idx, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(texts[idx], []).append(idx)
+        if missing:
+            new_texts = list(missing)
+            new_vectors = [_as_vector(vector) for vector in embed_fn(new_texts)]
+            self.put_many(zip(new_texts, new_vectors))
+            for text, vector in zip(new_texts, new_vectors):
+                for idx in missing[text]:
+                    vectors[idx] = vector
+        return vectors
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": self._disk_count if self._db is not None else 0,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key, vector):
+        if self.max_entries == 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        """超出 max_disk_entries 时按 rowid（写入顺序）删除最早的条目，调用方负责提交"""
+        excess = self._disk_count - self.max_disk_entries
+        if excess <= 0:
+            return
+        cursor = self._db.execute(
+            "DELETE FROM embedding_cache WHERE rowid IN (SELECT rowid FROM embedding_cache ORDER BY rowid LIMIT ?)",
+            (excess,)
+        )
+        self._disk_count -= cursor.rowcount
+
+
+def _as_vector(vector) -> np.ndarray:
+    """转成只读的 float32 数组，缓存命中方共享同一份数据，防止被意外修改"""
+    vector = np.array(vector, dtype=np.float32)
+    vector.flags.writeable = False
+    return vector
@@ -0,0 +1,39 @@
+'''
+导出向量库：将 Weaviate class 中的全部向量和元数据导出到本地文件，供本地检索索引使用
+'''
+import weaviate
+import warnings
+import os
+import yaml
+from local_vector_index import export_weaviate
+
+warnings.filterwarnings("ignore")
+
+def load_config(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+def main():
+    # 读取配置文件
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    settings_path = os.path.join(project_root, 'settings.yaml')
+    config = load_config(settings_path)
+
+    # Weaviate 配置
+    weaviate_config = config.get('weaviate', {})
+    weaviate_url = weaviate_config.get('url', 'http://localhost:8011')
+    class_name = weaviate_config.get('class_name', 'Security')
+
+    # 导出目录
+    index_config = config.get('vector_search', {}).get('local_index', {})
+    export_dir = index_config.get('export_dir', 'output/vector_export')
+    if not os.path.isabs(export_dir):
+        export_dir = os.path.join(project_root, export_dir)
+
+    print(f"Exporting class '{class_name}' from {weaviate_url} to {export_dir} ...")
+    client = weaviate.Client(url=weaviate_url)
+    count = export_weaviate(client, class_name, export_dir)
+    print(f"Exported {count} objects.")
+
+if __name__ == "__main__":
+    main()
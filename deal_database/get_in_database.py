@@ -1,7 +1,21 @@
 import psycopg2
+from psycopg2.extras import execute_values
 import yaml
 import json
 import os
+import io
+import sys
+import time
+import hashlib
+from winnowing import fingerprint
+from anchor_gram import count_document_frequency, choose_anchor
+
+# 与 model/extract_*.py 共用去重键的计算，避免两边的算法不一致
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if base_dir not in sys.path:
+    sys.path.append(base_dir)
+
+from model.code_hash import content_hash, strip_whitespace
 
 # 读取配置文件
 def get_file_path(yaml_file='settings.yaml'):
@@ -27,6 +41,384 @@ def get_db_config(yaml_file='settings.yaml'):
         'table_name': db_config['table_name']
     }
 
+# 读取 winnowing 指纹配置
+def get_fingerprint_config(yaml_file='settings.yaml'):
+    with open(yaml_file, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    return config['database'].get('fingerprint', {})
+
+# 读取锚点 k-gram 剪枝配置
+def get_anchor_config(yaml_file='settings.yaml'):
+    with open(yaml_file, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    return config['database'].get('anchor_gram', {})
+
+# 读取批量加载配置
+def get_load_config(yaml_file='settings.yaml'):
+    with open(yaml_file, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    return config['database'].get('load', {})
+
+# 读取是否创建 pg_trgm 三元组索引
+def get_trgm_enabled(yaml_file='settings.yaml'):
+    with open(yaml_file, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    return config['database'].get('trgm_index', True)
+
+
+def create_format_code_index(cur, table_name, use_trgm=True):
+    """
+    为 format_code 创建子串匹配索引。
+    B-tree 无法服务 LIKE '%...%'，且过长的代码会超出 B-tree 行大小限制，
+    因此启用 pg_trgm 时改用 GIN 三元组索引并删除旧的 B-tree 索引。
+    """
+    if use_trgm:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        cur.execute("DROP INDEX IF EXISTS idx_format_code;")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_format_code_trgm ON {table_name} USING gin (format_code gin_trgm_ops);")
+    else:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_format_code ON {table_name}(format_code);")
+
+
+def create_anchor_columns(cur, table_name):
+    """
+    剪枝列：code_len 为 format_code 的字符数，anchor_gram 为锚点 k-gram。
+    code_len 为 NULL 表示尚未计算；已计算但短于 k 的片段 anchor_gram 为 NULL
+    """
+    cur.execute(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS code_len INTEGER, ADD COLUMN IF NOT EXISTS anchor_gram TEXT;")
+
+
+def create_anchor_indexes(cur, table_name):
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_anchor_gram ON {table_name}(anchor_gram, code_len);")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_code_len ON {table_name}(code_len);")
+
+
+def create_search_indexes(cur, table_name, use_trgm=True, anchor_enabled=True):
+    """创建 /search 使用的全部二级索引"""
+    create_format_code_index(cur, table_name, use_trgm)
+    if anchor_enabled:
+        create_anchor_indexes(cur, table_name)
+
+
+def drop_search_indexes(cur, table_name):
+    """
+    大批量加载前删除二级索引，加载完成后用 create_search_indexes 一次性重建。
+    调用方需保证删除、加载和重建在同一个事务中提交
+    """
+    for index_name in ('idx_format_code', f'idx_{table_name}_format_code_trgm', f'idx_{table_name}_anchor_gram', f'idx_{table_name}_code_len'):
+        cur.execute(f"DROP INDEX IF EXISTS {index_name};")
+
+
+def index_anchor_grams(conn, table_name, k=6, chunk_size=1000):
+    """
+    为 code_len 为空的片段计算长度和锚点 k-gram。
+    第一遍流式读取全表统计 k-gram 文档频率，第二遍只更新新片段，已有片段的锚点保持不变
+    （锚点只需是片段的子串即可保证正确，语料增长后稀有度略有下降）
+    """
+    read_cur = conn.cursor(name='anchor_frequency_reader')
+    read_cur.itersize = chunk_size
+    read_cur.execute(f"SELECT COALESCE(format_code, '') FROM {table_name}")
+    frequency = count_document_frequency((code for (code,) in read_cur), k)
+    read_cur.close()
+
+    read_cur = conn.cursor(name='anchor_reader')
+    read_cur.itersize = chunk_size
+    read_cur.execute(f"SELECT id, COALESCE(format_code, '') FROM {table_name} WHERE code_len IS NULL")
+    write_cur = conn.cursor()
+    update_sql = f"""
+        UPDATE {table_name} AS t SET code_len = v.code_len, anchor_gram = v.anchor_gram
+        FROM (VALUES %s) AS v(id, code_len, anchor_gram)
+        WHERE t.id = v.id
+    """
+    total = 0
+    batch = []
+    for snippet_id, code in read_cur:
+        batch.append((snippet_id, len(code), choose_anchor(code, k, frequency)))
+        if len(batch) >= chunk_size:
+            execute_values(write_cur, update_sql, batch, template="(%s, %s, %s::text)")
+            total += len(batch)
+            batch = []
+    if batch:
+        execute_values(write_cur, update_sql, batch, template="(%s, %s, %s::text)")
+        total += len(batch)
+    read_cur.close()
+    write_cur.close()
+    return total
+
+
+def create_meta_table(cur, table_name):
+    """元数据表，保存表版本号等键值，供 API 的结果缓存判断数据是否变化"""
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table_name}_meta (
+        key TEXT PRIMARY KEY,
+        value BIGINT NOT NULL
+    );
+    """)
+
+
+def create_fingerprint_table(cur, table_name):
+    """
+    winnowing 指纹表：每行一个 (指纹哈希, 片段 id)，主键索引同时用于按哈希查找。
+    主表的 fingerprinted 列标记片段是否已计算过指纹（短于 k 的片段没有指纹行，靠它避免每次重复扫描）；
+    首次添加该列时，已有指纹行的片段直接标记为已处理
+    """
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table_name}_fingerprint (
+        hash BIGINT NOT NULL,
+        snippet_id INTEGER NOT NULL REFERENCES {table_name}(id) ON DELETE CASCADE,
+        PRIMARY KEY (hash, snippet_id)
+    );
+    """)
+    cur.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = 'fingerprinted'",
+        (table_name,)
+    )
+    if cur.fetchone() is None:
+        cur.execute(f"ALTER TABLE {table_name} ADD COLUMN fingerprinted BOOLEAN NOT NULL DEFAULT false;")
+        cur.execute(f"""
+        UPDATE {table_name} t SET fingerprinted = true
+        WHERE EXISTS (SELECT 1 FROM {table_name}_fingerprint f WHERE f.snippet_id = t.id);
+        """)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_unfingerprinted ON {table_name}(id) WHERE NOT fingerprinted;")
+
+
+def index_fingerprints(conn, table_name, k=8, window=4, chunk_size=1000):
+    """
+    为还没有处理过（fingerprinted 为 false）的片段计算 winnowing 指纹并写入指纹表，
+    既用于本次新插入的数据，也用于给历史数据补建指纹；没有指纹的短片段同样标记为已处理
+    """
+    read_cur = conn.cursor(name='fingerprint_reader')
+    read_cur.itersize = chunk_size
+    read_cur.execute(f"""
+        SELECT t.id, COALESCE(t.format_code, t.malicious_code)
+        FROM {table_name} t
+        WHERE NOT t.fingerprinted
+    """)
+    write_cur = conn.cursor()
+    snippets = 0
+    total = 0
+    batch = []
+    done_ids = []
+
+    def flush():
+        if batch:
+            execute_values(write_cur, f"INSERT INTO {table_name}_fingerprint (hash, snippet_id) VALUES %s ON CONFLICT DO NOTHING", batch)
+        write_cur.execute(f"UPDATE {table_name} SET fingerprinted = true WHERE id = ANY(%s)", (done_ids,))
+
+    for snippet_id, code in read_cur:
+        snippets += 1
+        batch.extend((h, snippet_id) for h in fingerprint(code, k, window))
+        done_ids.append(snippet_id)
+        if len(batch) >= chunk_size or len(done_ids) >= chunk_size:
+            flush()
+            total += len(batch)
+            batch = []
+            done_ids = []
+    if done_ids:
+        flush()
+        total += len(batch)
+    read_cur.close()
+    write_cur.close()
+    return snippets, total
+
+
+LOAD_COLUMNS = "file_name, title, malicious_code, description, format_code, hash_str"
+
+# 判断 JSONL 是否被重新生成时读取的文件头字节数
+WATERMARK_PREFIX_SIZE = 65536
+
+
+def create_content_hash_index(cur, table_name):
+    """
+    hash_str 唯一索引，ON CONFLICT 依赖它实现幂等写入。
+    首次创建时先把旧数据的占位 hash 重算为内容哈希（与 model/code_hash.py 的 content_hash 一致），并删除重复行（保留 id 最小的一条）
+    """
+    cur.execute("SELECT to_regclass(%s)", (f"idx_{table_name}_hash_str",))
+    if cur.fetchone()[0] is not None:
+        return
+    cur.execute(f"""
+    UPDATE {table_name} SET hash_str = encode(sha256(convert_to(
+        COALESCE(file_name, '') || E'\\n' || COALESCE(format_code, regexp_replace(COALESCE(malicious_code, ''), '\\s+', '', 'g')),
+        'UTF8')), 'hex');
+    """)
+    cur.execute(f"DELETE FROM {table_name} a USING {table_name} b WHERE a.hash_str = b.hash_str AND a.id > b.id;")
+    if cur.rowcount:
+        print(f"删除 {cur.rowcount} 条重复数据")
+    cur.execute(f"CREATE UNIQUE INDEX idx_{table_name}_hash_str ON {table_name}(hash_str);")
+
+
+def get_meta_value(cur, table_name, key, default=0):
+    cur.execute(f"SELECT value FROM {table_name}_meta WHERE key = %s;", (key,))
+    row = cur.fetchone()
+    return row[0] if row else default
+
+
+def set_meta_value(cur, table_name, key, value):
+    cur.execute(f"""
+    INSERT INTO {table_name}_meta (key, value) VALUES (%s, %s)
+    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;
+    """, (key, value))
+
+
+def file_prefix_signature(jsonl_path, size):
+    """文件前 size 字节（最多 WATERMARK_PREFIX_SIZE）的 64 位签名，用于发现文件被重新生成"""
+    with open(jsonl_path, 'rb') as f:
+        prefix = f.read(min(size, WATERMARK_PREFIX_SIZE))
+    return int.from_bytes(hashlib.blake2b(prefix, digest_size=8).digest(), 'big', signed=True)
+
+
+def get_watermark(cur, table_name, jsonl_path):
+    """
+    上次加载到的字节偏移。文件变短或文件头与上次不同（extract_*.py 重新生成了文件）时从头读取，
+    重复的行由 hash_str 唯一索引去重
+    """
+    offset = get_meta_value(cur, table_name, 'jsonl_offset')
+    if offset == 0:
+        return 0
+    if os.path.getsize(jsonl_path) < offset:
+        print("文件比上次加载时短，从头读取")
+        return 0
+    if file_prefix_signature(jsonl_path, offset) != get_meta_value(cur, table_name, 'jsonl_prefix'):
+        print("文件内容与上次加载时不同，从头读取")
+        return 0
+    return offset
+
+
+def save_watermark(cur, table_name, jsonl_path, offset):
+    set_meta_value(cur, table_name, 'jsonl_offset', offset)
+    set_meta_value(cur, table_name, 'jsonl_prefix', file_prefix_signature(jsonl_path, offset))
+
+
+def iter_jsonl_rows(jsonl_path, start_offset=0, position=None):
+    """
+    从 start_offset 字节处逐行读取 JSONL，按 LOAD_COLUMNS 的顺序产出每条记录，hash_str 为内容哈希。
+    position 不为 None 时在 position['offset'] 中记录已读取部分的结束偏移；
+    末尾没有换行且无法解析的行视为正在写入，不读取也不计入偏移
+    """
+    with open(jsonl_path, 'rb') as f:
+        f.seek(start_offset)
+        for line in f:
+            if not line.strip():
+                if position is not None and line.endswith(b'\n'):
+                    position['offset'] = f.tell()
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                if not line.endswith(b'\n'):
+                    break
+                raise
+            if position is not None:
+                position['offset'] = f.tell()
+
+            file_name = data.get('file_name')
+            malicious_code = data.get('malicious_code')
+            format_code = data.get('format_code')
+            hash_code = format_code if format_code is not None else strip_whitespace(malicious_code)
+            yield (
+                file_name,
+                data.get('title'),
+                malicious_code,
+                data.get('describe'),
+                format_code,
+                content_hash(file_name, hash_code)
+            )
+
+
+def conflict_clause(table_name, on_conflict='nothing'):
+    """
+    hash_str 冲突时：nothing 保留已有数据，update 用新数据覆盖标题、代码和描述。
+    update 只改写内容确实不同的行，重复加载同一文件时 rowcount 为 0，表版本号不会被无谓地递增
+    """
+    if on_conflict == 'update':
+        return (
+            "ON CONFLICT (hash_str) DO UPDATE SET title = EXCLUDED.title, "
+            "malicious_code = EXCLUDED.malicious_code, description = EXCLUDED.description "
+            f"WHERE ({table_name}.title, {table_name}.malicious_code, {table_name}.description) "
+            "IS DISTINCT FROM (EXCLUDED.title, EXCLUDED.malicious_code, EXCLUDED.description)"
+        )
+    return "ON CONFLICT (hash_str) DO NOTHING"
+
+
+def _copy_field(value):
+    """COPY text 格式的字段转义，None 写为 \\N"""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(cur, table_name, rows, chunk_size=5000, on_conflict='nothing'):
+    """
+    通过 COPY FROM STDIN 批量写入，每 chunk_size 行发送一次，内存占用与文件大小无关。
+    COPY 不支持 ON CONFLICT，因此先写入临时表，再 INSERT ... SELECT 合并到主表（同一块内的重复行只保留最后一条）。
+    返回 (读取行数, 写入行数)
+    """
+    cur.execute(f"""
+    CREATE TEMP TABLE IF NOT EXISTS {table_name}_staging (
+        seq BIGSERIAL,
+        file_name TEXT,
+        title TEXT,
+        malicious_code TEXT,
+        description TEXT,
+        format_code TEXT,
+        hash_str TEXT
+    ) ON COMMIT DROP;
+    """)
+    copy_sql = f"COPY {table_name}_staging ({LOAD_COLUMNS}) FROM STDIN"
+    merge_sql = (
+        f"INSERT INTO {table_name} ({LOAD_COLUMNS}) "
+        f"SELECT DISTINCT ON (hash_str) {LOAD_COLUMNS} FROM {table_name}_staging ORDER BY hash_str, seq DESC "
+        f"{conflict_clause(table_name, on_conflict)}"
+    )
+    count = 0
+    written = 0
+    buffer = io.StringIO()
+    buffered = 0
+
+    def flush():
+        buffer.seek(0)
+        cur.copy_expert(copy_sql, buffer)
+        cur.execute(merge_sql)
+        affected = cur.rowcount
+        cur.execute(f"TRUNCATE {table_name}_staging;")
+        return affected
+
+    for row in rows:
+        buffer.write('\t'.join(_copy_field(value) for value in row))
+        buffer.write('\n')
+        buffered += 1
+        if buffered >= chunk_size:
+            written += flush()
+            count += buffered
+            buffer = io.StringIO()
+            buffered = 0
+    if buffered:
+        written += flush()
+        count += buffered
+    return count, written
+
+
+def insert_rows(cur, table_name, rows, on_conflict='nothing'):
+    """逐行 INSERT 写入，返回 (读取行数, 写入行数)"""
+    insert_sql = f"INSERT INTO {table_name} ({LOAD_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s) {conflict_clause(table_name, on_conflict)}"
+    count = 0
+    written = 0
+    for row in rows:
+        cur.execute(insert_sql, row)
+        count += 1
+        written += cur.rowcount
+    return count, written
+
+
+def bump_table_version(cur, table_name):
+    """表内容变化后递增版本号"""
+    cur.execute(f"""
+    INSERT INTO {table_name}_meta (key, value) VALUES ('version', 1)
+    ON CONFLICT (key) DO UPDATE SET value = {table_name}_meta.value + 1
+    RETURNING value;
+    """)
+    return cur.fetchone()[0]
+
 
 def main():
     jsonl_path = get_file_path()
@@ -55,53 +447,77 @@ def main():
             format_code TEXT,    
             hash_str TEXT        
         );
-        
-        -- 为 format_code 创建索引，用于子串匹配
-        CREATE INDEX IF NOT EXISTS idx_format_code ON {table_name}(format_code);
         """
         cur.execute(create_table_sql)
-        conn.commit()
+        # hash_str 唯一索引：重复运行加载脚本不会重复写入
+        create_content_hash_index(cur, table_name)
 
-        # 4. 读取 JSONL 并插入
-        print(f"开始读取文件: {jsonl_path}")
-        count = 0
-        
-        with open(jsonl_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                if not line.strip():
-                    continue
-                    
-                data = json.loads(line)
-                
-                # 提取需要的字段
-                file_name = data.get('file_name')
-                title = data.get('title')
-                malicious_code = data.get('malicious_code')
-                description = data.get('describe')
-                format_code = data.get('format_code')  # 读取 format_code
-                
-                # hash 字段（原样存储）
-                hash = data.get('hash')
-
-                # 执行插入
-                insert_sql = f"""
-                INSERT INTO {table_name} 
-                (file_name, title, malicious_code, description, format_code, hash_str) 
-                VALUES (%s, %s, %s, %s, %s, %s)
-                """
-                
-                cur.execute(insert_sql, (
-                    file_name, 
-                    title, 
-                    malicious_code, 
-                    description,
-                    format_code,
-                    hash
-                ))
-                count += 1
+        create_meta_table(cur, table_name)
+        anchor_config = get_anchor_config()
+        anchor_enabled = anchor_config.get('enabled', True)
+        if anchor_enabled:
+            create_anchor_columns(cur, table_name)
+        fingerprint_config = get_fingerprint_config()
+        if fingerprint_config.get('enabled', True):
+            create_fingerprint_table(cur, table_name)
 
+        # 为 format_code 等列创建索引，用于子串匹配
+        load_config = get_load_config()
+        defer_indexes = load_config.get('defer_indexes', False)
+        use_trgm = get_trgm_enabled()
+        if not defer_indexes:
+            create_search_indexes(cur, table_name, use_trgm, anchor_enabled)
         conn.commit()
-        print(f"成功插入 {count} 条数据！")
+
+        if defer_indexes:
+            # 延迟建索引只用于离线的首次大批量加载：删除索引、加载、重建在同一个事务中，
+            # 失败回滚时索引随之恢复；事务期间表被排他锁定，API 的查询会等待到提交为止
+            drop_search_indexes(cur, table_name)
+
+        # 4. 读取 JSONL 并写入；增量模式只读取上次水位线之后追加的行
+        load_mode = load_config.get('mode', 'copy')
+        on_conflict = load_config.get('on_conflict', 'nothing')
+        incremental = load_config.get('incremental', True)
+        start_offset = get_watermark(cur, table_name, jsonl_path) if incremental else 0
+        print(f"开始读取文件: {jsonl_path} (mode={load_mode}, on_conflict={on_conflict}, offset={start_offset})")
+        start = time.time()
+        position = {'offset': start_offset}
+        rows = iter_jsonl_rows(jsonl_path, start_offset, position)
+        if load_mode == 'copy':
+            count, written = copy_rows(cur, table_name, rows, load_config.get('chunk_size', 5000), on_conflict)
+        else:
+            count, written = insert_rows(cur, table_name, rows, on_conflict)
+        if incremental:
+            save_watermark(cur, table_name, jsonl_path, position['offset'])
+        elapsed = time.time() - start
+        print(f"读取 {count} 行，写入 {written} 条数据，耗时 {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f} rows/s)")
+
+        # 5. 计算剪枝列（长度 + 锚点 k-gram）
+        if anchor_enabled:
+            anchored = index_anchor_grams(conn, table_name, k=anchor_config.get('k', 6))
+            print(f"为 {anchored} 个片段计算锚点 k-gram")
+
+        if defer_indexes:
+            start = time.time()
+            create_search_indexes(cur, table_name, use_trgm, anchor_enabled)
+            print(f"索引重建完成，耗时 {time.time() - start:.2f}s")
+
+        # 6. 计算 winnowing 指纹
+        if fingerprint_config.get('enabled', True):
+            snippets, fingerprints = index_fingerprints(
+                conn, table_name,
+                k=fingerprint_config.get('k', 8),
+                window=fingerprint_config.get('window', 4)
+            )
+            print(f"为 {snippets} 个片段写入 {fingerprints} 条指纹")
+
+        if written:
+            version = bump_table_version(cur, table_name)
+            conn.commit()
+            print(f"成功写入 {written} 条数据！表版本号更新为 {version}")
+        else:
+            conn.commit()
+            print("没有新数据，表版本号不变")
 
     except Exception as e:
         print(f"发生错误: {e}")
@@ -3,25 +3,145 @@
 '''
 import weaviate
 from weaviate.util import generate_uuid5
-import pandas as pd
 from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 import warnings
 warnings.filterwarnings("ignore")
 import os
+import json
+import time
+import queue
+import threading
 import yaml
+from code_precleaner import make_token_counter
+from embed_scheduler import embed_in_token_batches
 
 def load_config(file_path):
     with open(file_path, 'r', encoding='utf-8') as f:
         return yaml.safe_load(f)
 
-def deal_file(file_name, embed_model_name, client, class_name, target_seq_len=1024, batch_size=1):
-    df = pd.read_json(file_name, lines=True, encoding="utf-8")
-    
+def iter_jsonl_batches(file_name, batch_size):
+    """逐行读取 JSONL，每 batch_size 条产出一个字典列表，内存占用与文件大小无关"""
+    batch = []
+    with open(file_name, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+class StageCounter:
+    """单个流水线阶段的吞吐统计：处理条数和实际工作时间（不含等待队列的时间）"""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.busy_seconds = 0.0
+
+    def add(self, rows, seconds):
+        self.rows += rows
+        self.busy_seconds += seconds
+
+    def summary(self):
+        rate = self.rows / self.busy_seconds if self.busy_seconds else 0.0
+        return f"{self.name}: {self.rows} rows, busy {self.busy_seconds:.1f}s, {rate:.1f} rows/s"
+
+def build_properties(row):
+    return {
+        "title": row.get('title'),
+        "file_name": row.get('file_name'),
+        "code": row.get('code'),
+        "describe": row.get('describe'),
+        "hash": row.get('hash')
+    }
+
+def upload_worker(client, class_name, upload_queue, counter, errors):
+    """
+    上传阶段：从队列取出已向量化的批次，交给 Weaviate 动态批处理（并发 worker 发送），
+    收到 None 表示生产者结束
+    """
+    try:
+        with client.batch as batch:
+            while True:
+                item = upload_queue.get()
+                if item is None:
+                    flush_start = time.time()
+                    break
+                rows, embeddings = item
+                start = time.time()
+                for row, custom_vector in zip(rows, embeddings):
+                    properties = build_properties(row)
+                    batch.add_data_object(
+                        properties,
+                        class_name=class_name,
+                        vector=custom_vector,
+                        uuid=generate_uuid5(properties)
+                    )
+                counter.add(len(rows), time.time() - start)
+        # 退出上下文时发送剩余数据
+        counter.add(0, time.time() - flush_start)
+    except Exception as e:
+        errors.append(e)
+
+def put_with_backpressure(upload_queue, item, uploader, errors):
+    """队列满时阻塞等待上传阶段消费；上传线程异常退出时停止生产"""
+    while True:
+        if errors or not uploader.is_alive():
+            raise RuntimeError(f"Upload stage stopped: {errors[0] if errors else 'thread exited'}")
+        try:
+            upload_queue.put(item, timeout=1)
+            return
+        except queue.Full:
+            continue
+
+def finish_upload(upload_queue, uploader):
+    """发送结束标记并等待上传线程退出；上传线程已异常退出时不再等待队列空位"""
+    while uploader.is_alive():
+        try:
+            upload_queue.put(None, timeout=1)
+            break
+        except queue.Full:
+            continue
+    uploader.join()
+
+class BatchErrorCollector:
+    """Weaviate 批处理回调：收集服务端返回的逐对象错误（批次请求成功但个别对象写入失败）"""
+
+    MAX_SAMPLES = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.failed = 0
+        self.samples = []
+
+    def __call__(self, results):
+        for item in results or []:
+            result = item.get('result') or {}
+            if 'errors' not in result:
+                continue
+            with self._lock:
+                self.failed += 1
+                if len(self.samples) < self.MAX_SAMPLES:
+                    self.samples.append((item.get('id'), result['errors']))
+
+    def summary(self):
+        if not self.failed:
+            return "Failed objects: 0"
+        lines = [f"Failed objects: {self.failed}"]
+        lines.extend(f"  {uuid}: {error}" for uuid, error in self.samples)
+        return "\n".join(lines)
+
+def deal_file(file_name, embed_model_name, client, class_name, target_seq_len=1024, batch_size=1, queue_size=4, num_workers=2,
+              token_budget=0, max_encode_batch=256):
     # 初始化模型
     embed_model = HuggingFaceEmbeddings(
         model_name=embed_model_name,
         model_kwargs={"device": "cuda", "trust_remote_code": True},
-        encode_kwargs={"normalize_embeddings": True} # 加上归一化，与查询端保持一致
+        # 加上归一化，与查询端保持一致；batch_size 放大到分桶上限，避免 encode 再把一个桶按固定条数拆开
+        encode_kwargs={"normalize_embeddings": True, "batch_size": max_encode_batch}
     )
 
     if hasattr(embed_model, '_client'):
@@ -31,47 +151,52 @@ def deal_file(file_name, embed_model_name, client, class_name, target_seq_len=10
         
     print(f"Embedding model loaded. Max sequence length enforced to: {target_seq_len}")
 
-    num_rows = df.shape[0]
-    print(f"Total rows to process: {num_rows}")
+    # 每个读取批次内按 token 长度分桶编码，长度相近的代码放在同一次 encode 中
+    count_tokens = make_token_counter(embed_model)
+    print(f"Token budget per encode call: {token_budget} (tokenizer {'available' if count_tokens else 'unavailable, estimating from characters'})")
 
-    for start_idx in range(0, num_rows, batch_size):
-        end_idx = min(start_idx + batch_size, num_rows)
-        # 打印进度
-        print(f"Processing batch: {start_idx} to {end_idx} ...")
-        
-        batch_df = df[start_idx:end_idx].reset_index(drop=True)  # 重置索引
-        # 使用 code 列进行向量化
-        codes = batch_df['code'].tolist()
-
-        # 分批进行嵌入处理
-        code_embeddings = embed_model.embed_documents(codes)
-
-        data = {
-            "title": batch_df['title'],
-            "file_name": batch_df["file_name"],
-            "code": codes,
-            "describe": batch_df["describe"],
-            "hash": batch_df["hash"],
-            "embeddings": code_embeddings
-        }
-        df_with_embed = pd.DataFrame(data).reset_index(drop=True)  # 重置索引
-
-        with client.batch(batch_size=batch_size) as batch:
-            for i in range(df_with_embed.shape[0]):
-                properties = {
-                    "title": df_with_embed.title[i],
-                    "file_name": df_with_embed.file_name[i],
-                    "code": df_with_embed.code[i],
-                    "describe": df_with_embed['describe'][i],
-                    "hash": df_with_embed.hash[i]
-                }
-                custom_vector = df_with_embed.embeddings[i]
-                batch.add_data_object(
-                    properties,
-                    class_name=class_name,
-                    vector=custom_vector,
-                    uuid=generate_uuid5(properties)
-                )
+    # 流水线：主线程读取并向量化，上传线程写入 Weaviate，中间用有界队列衔接（队列满时向量化阶段等待）
+    batch_errors = BatchErrorCollector()
+    client.batch.configure(batch_size=batch_size, dynamic=True, num_workers=num_workers, callback=batch_errors)
+    upload_queue = queue.Queue(maxsize=queue_size)
+    embed_counter = StageCounter("embed")
+    upload_counter = StageCounter("upload")
+    errors = []
+    uploader = threading.Thread(
+        target=upload_worker,
+        args=(client, class_name, upload_queue, upload_counter, errors),
+        daemon=True
+    )
+    uploader.start()
+
+    pipeline_start = time.time()
+    start_idx = 0
+    try:
+        for rows in iter_jsonl_batches(file_name, batch_size):
+            end_idx = start_idx + len(rows)
+            # 打印进度
+            print(f"Processing batch: {start_idx} to {end_idx} (queued batches: {upload_queue.qsize()}) ...")
+
+            # 使用 code 字段进行向量化
+            codes = [row.get('code') for row in rows]
+            start = time.time()
+            code_embeddings = embed_in_token_batches(
+                embed_model.embed_documents, codes, count_tokens, token_budget, target_seq_len, max_encode_batch
+            )
+            embed_counter.add(len(rows), time.time() - start)
+
+            put_with_backpressure(upload_queue, (rows, code_embeddings), uploader, errors)
+            start_idx = end_idx
+    finally:
+        finish_upload(upload_queue, uploader)
+
+    if errors:
+        raise errors[0]
+    elapsed = time.time() - pipeline_start
+    print(f"Total rows processed: {start_idx} in {elapsed:.1f}s ({start_idx / max(elapsed, 1e-9):.1f} rows/s)")
+    print(embed_counter.summary())
+    print(upload_counter.summary())
+    print(batch_errors.summary())
 
 def main():
     # 读取配置文件
@@ -126,7 +251,15 @@ def main():
     print(f"Weaviate URL: {weaviate_url}")
     print(f"Class Name: {class_name}")
     
-    deal_file(file_path, embed_model_name, client, class_name, target_seq_len, batch_size=100)
+    ingest_config = weaviate_config.get('ingest', {})
+    deal_file(
+        file_path, embed_model_name, client, class_name, target_seq_len,
+        batch_size=ingest_config.get('batch_size', 100),
+        queue_size=ingest_config.get('queue_size', 4),
+        num_workers=ingest_config.get('num_workers', 2),
+        token_budget=code_model_config.get('batch_token_budget', 0),
+        max_encode_batch=code_model_config.get('max_batch_size', 256)
+    )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,134 @@
+import asyncio
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import List, Union
+
+import httpx
+import uvicorn
+import yaml
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+# 全局变量存储资源
+app_state = {}
+
+def load_config():
+    # 读取同级或上级目录的 settings.yaml
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    settings_path = os.path.join(base_dir, 'settings.yaml')
+    with open(settings_path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+def _local_url(host, port, path):
+    # 0.0.0.0 只能用于监听，访问时换成本机地址
+    if host == "0.0.0.0":
+        host = "127.0.0.1"
+    return f"http://{host}:{port}{path}"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    config = load_config()
+    hybrid_conf = config.get('hybrid_search', {})
+    api_conf = config.get('api_server', {})
+    vector_conf = config.get('vector_search', {})
+
+    # 两个后端的地址，默认使用本机上各自配置的端口
+    app_state['substring_url'] = hybrid_conf.get('substring_url') or _local_url(
+        api_conf.get('host', '0.0.0.0'), api_conf.get('port', 5126), '/search')
+    app_state['vector_url'] = hybrid_conf.get('vector_url') or _local_url(
+        vector_conf.get('host', '0.0.0.0'), vector_conf.get('port', 5127), '/vector_search')
+    app_state['deadline'] = hybrid_conf.get('deadline', 60)
+    app_state['http_client'] = httpx.AsyncClient(timeout=None)
+    print(f"Hybrid search backends: substring={app_state['substring_url']}, vector={app_state['vector_url']}, deadline={app_state['deadline']}s")
+
+    yield
+
+    await app_state['http_client'].aclose()
+    app_state.clear()
+
+app = FastAPI(title="Hybrid Malicious Code Search API", lifespan=lifespan)
+
+class HybridSearchRequest(BaseModel):
+    query_code: Union[str, List[str]]
+
+async def _post(url, payload):
+    response = await app_state['http_client'].post(url, json=payload)
+    response.raise_for_status()
+    return response.json()
+
+def _dedup_key(file_name, code):
+    # 与 format_code 一致：去除空白后比较
+    return (file_name, re.sub(r'[\s\n]+', '', code or ''))
+
+def merge_results(queries, substring_resp, vector_resp):
+    """
+    按输入合并两个后端的结果：精确匹配在前，向量检索结果去掉与精确匹配重复的片段
+    """
+    exact_by_code = {}
+    for item in (substring_resp or {}).get('data', []):
+        exact_by_code[item['code_string']] = item.get('records', [])
+    vector_list = (vector_resp or {}).get('data', [])
+
+    merged = []
+    for idx, q in enumerate(queries):
+        records = []
+        seen = set()
+        for record in exact_by_code.get(q, []):
+            seen.add(_dedup_key(record.get('file_name'), record.get('malicious_code')))
+            records.append({**record, "match_type": "exact"})
+        vector_records = vector_list[idx].get('records', []) if idx < len(vector_list) else []
+        for record in vector_records or []:
+            key = _dedup_key(record.get('file_name'), record.get('code'))
+            if key in seen:
+                continue
+            seen.add(key)
+            records.append({**record, "match_type": "vector"})
+        merged.append({"input_code": q, "records": records})
+    return merged
+
+@app.post("/hybrid_search")
+async def hybrid_search(request: HybridSearchRequest):
+    """
+    同时请求子串匹配和向量检索两个后端，在统一的截止时间内合并结果。
+    超时或失败的后端在 errors 中说明，已返回的结果照常合并（partial 为 true）。
+    """
+    queries = [request.query_code] if isinstance(request.query_code, str) else request.query_code
+    if not queries:
+        return {"message": "Empty query", "partial": False, "errors": {}, "data": []}
+
+    start = time.time()
+    tasks = {
+        "substring": asyncio.create_task(_post(app_state['substring_url'], {"code_strings": queries})),
+        "vector": asyncio.create_task(_post(app_state['vector_url'], {"query_code": queries})),
+    }
+    done, pending = await asyncio.wait(tasks.values(), timeout=app_state['deadline'])
+    for task in pending:
+        task.cancel()
+
+    responses, errors = {}, {}
+    for name, task in tasks.items():
+        if task in pending:
+            errors[name] = f"timed out after {app_state['deadline']}s"
+        elif task.exception() is not None:
+            errors[name] = str(task.exception())
+        else:
+            responses[name] = task.result()
+
+    if not responses:
+        raise HTTPException(status_code=504 if pending else 502, detail=errors)
+
+    merged = merge_results(queries, responses.get('substring'), responses.get('vector'))
+    print(f"Hybrid search for {len(queries)} queries finished in {time.time() - start:.3f}s, errors: {errors}")
+    message = "Success" if any(item['records'] for item in merged) else "No results found for any query"
+    return {"message": message, "partial": bool(errors), "errors": errors, "data": merged}
+
+if __name__ == "__main__":
+    # 读取配置启动服务
+    config = load_config()
+    server_conf = config.get('hybrid_search', {})
+    host = server_conf.get('host', '0.0.0.0')
+    port = server_conf.get('port', 5128)
+
+    uvicorn.run(app, host=host, port=port)
@@ -0,0 +1,312 @@
+'''
+进程内精确 top-k 检索：把 Weaviate 中的全部向量和元数据加载为连续的 float32 矩阵
+'''
+import json
+import os
+import threading
+from typing import Dict, List
+
+import numpy as np
+
+# 单次矩阵乘法生成的相似度矩阵元素上限，避免超大请求一次占满内存
+MAX_SCORE_ELEMENTS = 1 << 26
+
+
+EXPORT_META_FILE = 'export_meta.json'
+# 导出时向临时文件追加向量、再转成 .npy 的分块行数
+EXPORT_COPY_ROWS = 65536
+
+
+def _normalize(matrix, inplace=False):
+    """按行归一化；inplace 时直接在 float32 矩阵上原地修改，避免再复制一份"""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if matrix.size == 0:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    if inplace:
+        matrix /= norms
+        return matrix
+    return matrix / norms
+
+
+class VectorBuffer:
+    """
+    可增长的 float32 行矩阵：逐个追加向量时直接写入预分配的数组，容量不足时翻倍，
+    不保留 Python float 列表
+    """
+
+    def __init__(self, capacity=1024):
+        self._capacity = max(1, int(capacity))
+        self._data = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, vector):
+        if self._data is None:
+            self._data = np.empty((self._capacity, len(vector)), dtype=np.float32)
+        elif self._size == len(self._data):
+            grown = np.empty((len(self._data) * 2, self._data.shape[1]), dtype=np.float32)
+            grown[:self._size] = self._data
+            self._data = grown
+        self._data[self._size] = vector
+        self._size += 1
+
+    def array(self):
+        """返回 (N, D) 连续数组；容量有富余时复制一次截断，释放多余空间"""
+        if self._data is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        if self._size == len(self._data):
+            return self._data
+        return self._data[:self._size].copy()
+
+
+def certainty_to_cosine(certainty):
+    """Weaviate 的 certainty = (1 + cos) / 2，换算成余弦相似度阈值"""
+    return 2.0 * float(certainty) - 1.0
+
+
+def format_match(metadata, cosine):
+    """组装成与 Weaviate GraphQL 返回一致的结构"""
+    record = dict(metadata.get('properties', {}))
+    record['_additional'] = {
+        'id': metadata.get('id'),
+        'distance': float(1.0 - cosine),
+        'certainty': float((1.0 + cosine) / 2.0),
+    }
+    return record
+
+
+def iter_weaviate_objects(client, class_name, page_size=500, with_vector=True):
+    """用 cursor API 分页遍历 class 中的所有对象"""
+    after = None
+    while True:
+        resp = client.data_object.get(
+            class_name=class_name,
+            with_vector=with_vector,
+            limit=page_size,
+            after=after
+        )
+        objects = resp.get('objects', []) if resp else []
+        if not objects:
+            break
+        for obj in objects:
+            yield obj
+        after = objects[-1]['id']
+
+
+def object_metadata(obj):
+    """保存 id、属性和最后更新时间（毫秒），增量同步时据此判断对象是否被修改"""
+    return {
+        'id': obj['id'],
+        'properties': obj.get('properties', {}),
+        'updated': int(obj.get('lastUpdateTimeUnix') or 0),
+    }
+
+
+def iter_object_versions(client, class_name, page_size=500):
+    """用 cursor API 分页遍历 (id, 最后更新时间)，不拉取向量和属性"""
+    after = None
+    while True:
+        query = client.query.get(class_name).with_additional(['id', 'lastUpdateTimeUnix']).with_limit(page_size)
+        if after:
+            query = query.with_after(after)
+        page = query.do()['data']['Get'][class_name] or []
+        if not page:
+            break
+        for item in page:
+            additional = item['_additional']
+            yield additional['id'], int(additional.get('lastUpdateTimeUnix') or 0)
+        after = page[-1]['_additional']['id']
+
+
+def fetch_objects_by_id(client, class_name, uuids, batch_size=100):
+    """按 id 分批拉取对象（含向量），每批一次 GraphQL 请求"""
+    property_names = [prop['name'] for prop in client.schema.get(class_name).get('properties', [])]
+    uuids = list(uuids)
+    for start in range(0, len(uuids), batch_size):
+        chunk = uuids[start:start + batch_size]
+        where = {
+            'operator': 'Or',
+            'operands': [{'path': ['id'], 'operator': 'Equal', 'valueText': uuid} for uuid in chunk],
+        }
+        page = (
+            client.query.get(class_name, property_names)
+            .with_additional(['id', 'vector', 'lastUpdateTimeUnix'])
+            .with_where(where)
+            .with_limit(len(chunk))
+            .do()['data']['Get'][class_name] or []
+        )
+        for item in page:
+            additional = item.pop('_additional')
+            yield {
+                'id': additional['id'],
+                'vector': additional['vector'],
+                'properties': item,
+                'lastUpdateTimeUnix': additional.get('lastUpdateTimeUnix'),
+            }
+
+
+def export_weaviate(client, class_name, export_dir, page_size=500):
+    """
+    导出 class 到 export_dir：vectors.npy（N x D float32）与 metadata.jsonl（每行对应一个向量）
+    """
+    os.makedirs(export_dir, exist_ok=True)
+    raw_path = os.path.join(export_dir, 'vectors.f32.tmp')
+    count, dim, max_updated = 0, 0, 0
+    # 向量逐个以 float32 追加到临时文件，内存中只保留当前分页
+    with open(os.path.join(export_dir, 'metadata.jsonl'), 'w', encoding='utf-8') as f, open(raw_path, 'wb') as raw:
+        for obj in iter_weaviate_objects(client, class_name, page_size):
+            vector = np.asarray(obj['vector'], dtype=np.float32)
+            dim = dim or len(vector)
+            raw.write(vector.tobytes())
+            metadata = object_metadata(obj)
+            f.write(json.dumps(metadata, ensure_ascii=False))
+            f.write('\n')
+            count += 1
+            max_updated = max(max_updated, metadata['updated'])
+
+    # 分块复制为 .npy，供后续以 mmap 方式读取
+    vectors = np.lib.format.open_memmap(
+        os.path.join(export_dir, 'vectors.npy'), mode='w+', dtype=np.float32, shape=(count, dim)
+    )
+    if count:
+        source = np.memmap(raw_path, dtype=np.float32, mode='r', shape=(count, dim))
+        for start in range(0, count, EXPORT_COPY_ROWS):
+            vectors[start:start + EXPORT_COPY_ROWS] = source[start:start + EXPORT_COPY_ROWS]
+        del source
+    vectors.flush()
+    del vectors
+    os.remove(raw_path)
+    # 记录导出时 class 的对象数和最大更新时间，用于判断导出是否已过期
+    with open(os.path.join(export_dir, EXPORT_META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'class_name': class_name, 'count': count, 'max_updated': max_updated}, f)
+    return count
+
+
+def collection_signature(client, class_name, page_size=500):
+    """(对象数, 最大更新时间)，只扫描 id 和时间戳"""
+    count, max_updated = 0, 0
+    for _, updated in iter_object_versions(client, class_name, page_size):
+        count += 1
+        max_updated = max(max_updated, updated)
+    return count, max_updated
+
+
+def export_is_current(client, class_name, export_dir, page_size=500):
+    """导出目录存在且记录的对象数、最大更新时间与 class 当前状态一致"""
+    meta_path = os.path.join(export_dir, EXPORT_META_FILE)
+    if not os.path.exists(os.path.join(export_dir, 'vectors.npy')) or not os.path.exists(meta_path):
+        return False
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('class_name') != class_name:
+        return False
+    return (meta.get('count'), meta.get('max_updated')) == collection_signature(client, class_name, page_size)
+
+
+def load_export(export_dir, mmap=False):
+    """读取 export_weaviate 的导出结果，返回 (vectors, metadata_list)"""
+    vectors = np.load(os.path.join(export_dir, 'vectors.npy'), mmap_mode='r' if mmap else None)
+    metadata = []
+    with open(os.path.join(export_dir, 'metadata.jsonl'), 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                metadata.append(json.loads(line))
+    if len(metadata) != vectors.shape[0]:
+        raise ValueError(f"导出文件不一致: {vectors.shape[0]} 个向量, {len(metadata)} 条元数据")
+    return vectors, metadata
+
+
+class ExactVectorIndex:
+    """
+    暴力精确检索：一次矩阵乘法 + argpartition 取 top-k。
+    数据以 (matrix, metadata) 元组整体替换，检索时无需加锁。
+    """
+
+    def __init__(self, vectors=None, metadata=None, inplace=False):
+        self._lock = threading.Lock()  # 只串行化写操作
+        self._data = (np.zeros((0, 0), dtype=np.float32), [])
+        if vectors is not None:
+            self._data = (_normalize(vectors, inplace=inplace), list(metadata))
+
+    def __len__(self):
+        return len(self._data[1])
+
+    @classmethod
+    def from_export(cls, export_dir):
+        vectors, metadata = load_export(export_dir)
+        return cls(vectors, metadata, inplace=True)
+
+    @classmethod
+    def from_weaviate(cls, client, class_name, page_size=500):
+        vectors, metadata = VectorBuffer(), []
+        for obj in iter_weaviate_objects(client, class_name, page_size):
+            vectors.append(obj['vector'])
+            metadata.append(object_metadata(obj))
+        if not metadata:
+            return cls()
+        return cls(vectors.array(), metadata, inplace=True)
+
+    def search(self, query_vectors, top_k, certainty=0.0) -> List[List[Dict]]:
+        matrix, metadata = self._data
+        n = len(metadata)
+        if n == 0 or len(query_vectors) == 0:
+            return [[] for _ in range(len(query_vectors))]
+        queries = _normalize(np.asarray(query_vectors, dtype=np.float32))
+        k = min(int(top_k), n)
+        min_cosine = certainty_to_cosine(certainty)
+        chunk = max(1, MAX_SCORE_ELEMENTS // n)
+
+        results = []
+        for start in range(0, len(queries), chunk):
+            scores = queries[start:start + chunk] @ matrix.T
+            if k < n:
+                top_idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top_idx = np.tile(np.arange(n), (scores.shape[0], 1))
+            top_scores = np.take_along_axis(scores, top_idx, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top_idx = np.take_along_axis(top_idx, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            for row_idx, row_scores in zip(top_idx, top_scores):
+                results.append([
+                    format_match(metadata[i], float(s))
+                    for i, s in zip(row_idx, row_scores) if s >= min_cosine
+                ])
+        return results
+
+    def refresh_from_weaviate(self, client, class_name, page_size=500):
+        """
+        增量同步：用 cursor API 扫描远端的 (id, 最后更新时间)，
+        新增或更新时间变化的对象按批拉取向量替换，远端已不存在的对象删除。
+        返回 (新增或更新数, 删除数)。
+        """
+        with self._lock:
+            matrix, metadata = self._data
+            remote_versions = dict(iter_object_versions(client, class_name, page_size))
+
+            keep = [
+                i for i, meta in enumerate(metadata)
+                if remote_versions.get(meta['id']) == meta.get('updated', 0)
+            ]
+            known_ids = {metadata[i]['id'] for i in keep}
+            changed_ids = [uuid for uuid in remote_versions if uuid not in known_ids]
+            new_vectors, new_metadata = VectorBuffer(), []
+            for obj in fetch_objects_by_id(client, class_name, changed_ids):
+                new_vectors.append(obj['vector'])
+                new_metadata.append(object_metadata(obj))
+
+            # 被更新的对象先从 keep 中剔除再重新加入，不计入删除数
+            local_ids = {meta['id'] for meta in metadata}
+            removed = sum(1 for uuid in local_ids if uuid not in remote_versions)
+            if not new_metadata and len(keep) == len(metadata):
+                return 0, 0
+            parts = [matrix[keep]] if keep else []
+            if new_metadata:
+                parts.append(_normalize(new_vectors.array(), inplace=True))
+            merged = np.concatenate(parts, axis=0) if parts else np.zeros((0, 0), dtype=np.float32)
+            self._data = (np.ascontiguousarray(merged), [metadata[i] for i in keep] + new_metadata)
+            return len(new_metadata), removed
@@ -0,0 +1,65 @@
+'''
+大输入的多进程 Aho-Corasick 扫描：输入按段切分（相邻段重叠 最长模式串长度-1 个字符），
+各段在进程池中扫描后合并结果，避免数 MB 的输入阻塞服务其他请求的事件循环
+'''
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Set, Tuple
+
+from aho_corasick import AhoCorasick
+
+# 每个工作进程各自持有一份自动机
+_worker_automaton = None
+
+
+def _init_worker(patterns):
+    global _worker_automaton
+    _worker_automaton = AhoCorasick(patterns)
+
+
+def _scan_segment(segment: str) -> List[int]:
+    return list(_worker_automaton.search(segment))
+
+
+def _pool_context():
+    """
+    服务进程里已有事件循环、数据库连接池等多个线程，直接 fork 可能复制到被其他线程持有的锁，
+    进程池改用 forkserver（不支持的平台用 spawn）启动
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def split_segments(text: str, segment_size: int, overlap: int) -> List[str]:
+    """按 segment_size 切分，每段向后多取 overlap 个字符，保证跨段的匹配不会丢失"""
+    segment_size = max(1, segment_size)
+    return [text[start:start + segment_size + overlap] for start in range(0, len(text), segment_size)]
+
+
+class ParallelScanner:
+    """
+    持有一个进程池，池中每个进程在初始化时构建同一份自动机（模式串经 pickle 传给工作进程）。
+    """
+
+    def __init__(self, patterns: List[Tuple[int, str]], workers=4, segment_size=262144):
+        self.segment_size = int(segment_size)
+        self.overlap = max((len(pattern) for _, pattern in patterns), default=1) - 1
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=_pool_context(),
+            initializer=_init_worker,
+            initargs=(patterns,)
+        )
+
+    async def search(self, text: str) -> Set[int]:
+        loop = asyncio.get_running_loop()
+        segments = split_segments(text, self.segment_size, self.overlap)
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self.executor, _scan_segment, segment) for segment in segments
+        ))
+        return {pattern_id for ids in results for pattern_id in ids}
+
+    def close(self):
+        # 已提交的任务继续执行完，正在使用旧快照的请求不受影响
+        self.executor.shutdown(wait=False)
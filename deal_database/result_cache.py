@@ -0,0 +1,57 @@
+'''
+/search 结果缓存：按 (去空白后的输入, 匹配逻辑) 的哈希缓存，表版本号变化时整体失效
+'''
+import hashlib
+import json
+from collections import OrderedDict
+
+
+class VersionedResultCache:
+    """
+    只在事件循环线程中使用，不需要加锁。
+    set_version 发现版本变化时清空缓存，之后的查询重新访问数据库。
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max(1, int(max_entries))
+        self.version = None
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(cleaned_code: str, match_logic: dict) -> str:
+        logic = json.dumps(match_logic, sort_keys=True)
+        return hashlib.sha256(f"{logic}\0{cleaned_code}".encode('utf-8')).hexdigest()
+
+    def set_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+            return True
+        return False
+
+    def get(self, key):
+        rows = self._entries.get(key)
+        if rows is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return rows
+
+    def put(self, key, rows):
+        self._entries[key] = rows
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "version": self.version,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -1,5 +1,8 @@
 import weaviate
 import yaml
+import asyncio
+import threading
+import json
 import os
 import sys
 import torch
@@ -7,6 +10,8 @@ import uvicorn
 from typing import Optional, List, Union
 from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
 from langchain_huggingface.embeddings import HuggingFaceEmbeddings
@@ -18,6 +23,13 @@ if base_dir not in sys.path:
     sys.path.append(base_dir)
 
 from model.extract_prompt import CLEAN_MALICIOUS_CODE_PROMPT
+from embed_scheduler import EmbeddingBatcher
+from embedding_cache import EmbeddingCache
+from clean_cache import CleanCache
+from local_vector_index import ExactVectorIndex
+from ann_index import IVFIndex
+from code_precleaner import CleaningPolicy, make_token_counter
+from code_chunker import split_code_windows, aggregate_window_matches
 
 class ChatModel:
     def __init__(self, chat_config):
@@ -76,41 +88,87 @@ def load_config():
     with open(settings_path, 'r', encoding='utf-8') as f:
         return yaml.safe_load(f)
 
-def clean_code_logic(code: str, chat_model: ChatModel) -> str:
+def _postprocess_cleaned(cleaned_content: str) -> str:
     """
-    Cleans the input code string using LLM if it's too long.
-    Uses logic similar to z.py.
+    Strips whitespace and markdown fences from the LLM output.
     """
+    cleaned_content = cleaned_content.strip()
+    
+    # Remove markdown code blocks if present
+    if cleaned_content.startswith("```"):
+        lines = cleaned_content.splitlines()
+        if lines[0].startswith("```"):
+            lines = lines[1:]
+        if lines and lines[-1].startswith("```"):
+            lines = lines[:-1]
+        cleaned_content = "\n".join(lines).strip()
+        
+    if cleaned_content == "CLEAN_CODE":
+        return "" # Return empty if absolutely no malicious code found
+        
+    return cleaned_content
+
+async def clean_code_logic_async(code: str, chat_model: ChatModel, semaphore: asyncio.Semaphore, clean_cache: Optional[CleanCache] = None) -> str:
+    """
+    Cleans the input code string using the LLM. The semaphore bounds concurrent LLM calls across the whole server.
+    Successful results are stored in clean_cache when given; its SQLite calls run in the threadpool.
+    """
+    if clean_cache is not None:
+        cached = await run_in_threadpool(clean_cache.get, code)
+        if cached is not None:
+            return cached
     try:
         system_prompt = "You are a code security analysis expert."
         user_prompt = CLEAN_MALICIOUS_CODE_PROMPT.format(CODE=code)
         
-        cleaned_content = chat_model.get_chat(
-            system_prompt=system_prompt,
-            user_prompt=user_prompt
-        )
-        
-        # Post-processing
-        cleaned_content = cleaned_content.strip()
+        async with semaphore:
+            cleaned_content = await chat_model.get_chat_async(
+                system_prompt=system_prompt,
+                user_prompt=user_prompt
+            )
         
-        # Remove markdown code blocks if present
-        if cleaned_content.startswith("```"):
-            lines = cleaned_content.splitlines()
-            if lines[0].startswith("```"):
-                lines = lines[1:]
-            if lines and lines[-1].startswith("```"):
-                lines = lines[:-1]
-            cleaned_content = "\n".join(lines).strip()
-            
-        if cleaned_content == "CLEAN_CODE":
-            return "" # Return empty if absolutely no malicious code found
-            
+        cleaned_content = _postprocess_cleaned(cleaned_content)
+        if clean_cache is not None:
+            await run_in_threadpool(clean_cache.put, code, cleaned_content)
         return cleaned_content
         
     except Exception as e:
+        # 失败时返回原始代码，且不写入缓存
         print(f"LLM Processing Error during cleaning: {e}")
         return code
 
+def load_local_index(index_conf):
+    """
+    加载进程内检索索引，并按需启动后台线程定期从 Weaviate 增量同步
+    """
+    source = index_conf.get('source', 'weaviate')
+    if source == 'export':
+        export_dir = index_conf.get('export_dir', 'output/vector_export')
+        if not os.path.isabs(export_dir):
+            export_dir = os.path.join(base_dir, export_dir)
+        index = ExactVectorIndex.from_export(export_dir)
+    else:
+        index = ExactVectorIndex.from_weaviate(app_state['client'], app_state['class_name'])
+    app_state['local_index'] = index
+    print(f"Local vector index loaded from {source}: {len(index)} vectors")
+
+    refresh_interval = index_conf.get('refresh_interval', 60)
+    if not refresh_interval:
+        return
+    stop_event = threading.Event()
+    app_state['index_stop'] = stop_event
+
+    def _refresh_loop():
+        while not stop_event.wait(refresh_interval):
+            try:
+                added, removed = index.refresh_from_weaviate(app_state['client'], app_state['class_name'])
+                if added or removed:
+                    print(f"Local vector index refreshed: +{added} / -{removed}, total {len(index)}")
+            except Exception as e:
+                print(f"Local vector index refresh failed: {e}")
+
+    threading.Thread(target=_refresh_loop, name="local-index-refresh", daemon=True).start()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 启动时加载配置和模型
@@ -133,6 +191,24 @@ async def lifespan(app: FastAPI):
     app_state['top_k'] = vector_search_conf.get('top_k', 5)
     app_state['certainty'] = vector_search_conf.get('certainty', 0.8)
     app_state['max_clean_threshold'] = vector_search_conf.get('max_clean_threshold', 1200)
+    # 检索后端：multi_get 将一个请求的所有向量打包成一次 GraphQL 请求；threads 为每个向量单独请求；
+    # exact 在进程内对全量向量矩阵做精确检索；ann 使用本地内存映射的 IVF 近似索引
+    app_state['search_backend'] = vector_search_conf.get('search_backend', 'multi_get')
+    app_state['multi_get_chunk_size'] = vector_search_conf.get('multi_get_chunk_size', 50)
+    app_state['search_executor'] = ThreadPoolExecutor(max_workers=app_state['max_threads'])
+    print(f"Vector search backend: {app_state['search_backend']}")
+    if app_state['search_backend'] == 'exact':
+        load_local_index(vector_search_conf.get('local_index', {}))
+    elif app_state['search_backend'] == 'ann':
+        ann_conf = vector_search_conf.get('ann_index', {})
+        index_dir = ann_conf.get('index_dir', 'output/ann_index')
+        if not os.path.isabs(index_dir):
+            index_dir = os.path.join(base_dir, index_dir)
+        app_state['local_index'] = IVFIndex(index_dir, nprobe=ann_conf.get('nprobe', 8))
+        print(f"ANN index loaded from {index_dir}: {len(app_state['local_index'])} vectors, nprobe={app_state['local_index'].nprobe}")
+    # 全服务共享的 LLM 清洗并发上限
+    app_state['clean_semaphore'] = asyncio.Semaphore(vector_search_conf.get('max_clean_concurrency', 8))
+    app_state['stream_concurrency'] = vector_search_conf.get('stream_concurrency', 16)
 
     # 初始化 ChatModel 用于代码清洗
     try:
@@ -141,6 +217,22 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"Failed to initialize ChatModel: {e}")
         app_state['chat_model'] = None
+
+    # 初始化清洗结果缓存，相同代码重复扫描时不再调用 LLM
+    clean_cache_conf = vector_search_conf.get('clean_cache', {})
+    app_state['clean_cache'] = None
+    if clean_cache_conf.get('enabled', True):
+        clean_cache_path = clean_cache_conf.get('disk_path', 'cache/clean_cache.sqlite3')
+        if not os.path.isabs(clean_cache_path):
+            clean_cache_path = os.path.join(base_dir, clean_cache_path)
+        app_state['clean_cache'] = CleanCache(
+            disk_path=clean_cache_path,
+            prompt_template=CLEAN_MALICIOUS_CODE_PROMPT,
+            model_name=chat_conf.get('model_name'),
+            ttl_seconds=clean_cache_conf.get('ttl_seconds', 0),
+            max_entries=clean_cache_conf.get('max_entries', 100000)
+        )
+        print(f"Clean cache initialized at: {clean_cache_path}")
     
     # 初始化 Embedding 模型
     model_path = model_conf.get('model_path')
@@ -151,7 +243,8 @@ async def lifespan(app: FastAPI):
     embeddings = HuggingFaceEmbeddings(
         model_name=model_path,
         model_kwargs={"device": device, "trust_remote_code": True},
-        encode_kwargs={"normalize_embeddings": True} # 推荐加上归一化
+        # 推荐加上归一化；batch_size 放大到分桶上限，避免 encode 再把一个桶按固定条数拆开
+        encode_kwargs={"normalize_embeddings": True, "batch_size": model_conf.get('max_batch_size', 256)}
     )
     
     target_seq_len = model_conf.get('max_seq_length', 1024)
@@ -164,10 +257,63 @@ async def lifespan(app: FastAPI):
 
     app_state['embed_model'] = embeddings
     print(f"Embedding model loaded successfully. Max sequence length set to: {target_seq_len}")
+
+    # 清洗策略：规则预清洗后用 embedding 模型的 tokenizer 计算长度，超过预算才调用 LLM
+    policy_conf = vector_search_conf.get('clean_policy', {})
+    count_tokens = make_token_counter(embeddings) if policy_conf.get('use_tokenizer', True) else None
+    app_state['clean_policy'] = CleaningPolicy(
+        char_threshold=app_state['max_clean_threshold'],
+        token_budget=policy_conf.get('token_budget', 2048),
+        count_tokens=count_tokens,
+        preclean=policy_conf.get('preclean', True)
+    )
+    print(f"Clean policy: {policy_conf} (tokenizer {'available' if count_tokens else 'unavailable, falling back to character length'})")
+
+    # 长代码处理模式：llm 调用大模型清洗；chunk 切分为重叠窗口分别检索后聚合
+    app_state['long_code_mode'] = vector_search_conf.get('long_code_mode', 'llm')
+    app_state['chunk_conf'] = vector_search_conf.get('chunk', {})
+    print(f"Long code mode: {app_state['long_code_mode']}")
+
+    # 初始化微批调度器，合并并发请求的查询向量化，合并后按 token 长度分桶编码
+    batch_conf = vector_search_conf.get('embed_batch', {})
+    app_state['embed_batcher'] = EmbeddingBatcher(
+        embeddings,
+        max_batch_size=batch_conf.get('max_batch_size', 64),
+        max_wait_ms=batch_conf.get('max_wait_ms', 10),
+        count_tokens=count_tokens or make_token_counter(embeddings),
+        token_budget=model_conf.get('batch_token_budget', 0),
+        max_seq_length=target_seq_len
+    )
+    print(f"Embedding batcher started with config: {batch_conf}, token budget: {model_conf.get('batch_token_budget', 0)}")
+
+    # 初始化查询向量缓存，重复查询直接跳过 encoder
+    cache_conf = vector_search_conf.get('embed_cache', {})
+    disk_path = cache_conf.get('disk_path')
+    if disk_path and not os.path.isabs(disk_path):
+        disk_path = os.path.join(base_dir, disk_path)
+    app_state['embed_cache'] = EmbeddingCache(
+        model_id=model_path,
+        max_seq_length=target_seq_len,
+        max_entries=cache_conf.get('max_entries', 10000),
+        disk_path=disk_path,
+        max_disk_entries=cache_conf.get('max_disk_entries', 200000)
+    )
+    print(f"Embedding cache initialized (max_entries={cache_conf.get('max_entries', 10000)}, disk_path={disk_path})")
     
     yield
     
     # 关闭时清理资源
+    app_state['embed_batcher'].close()
+    app_state['embed_cache'].close()
+    if app_state.get('clean_cache'):
+        app_state['clean_cache'].close()
+    if app_state.get('chat_model'):
+        await app_state['chat_model'].close_async()
+    app_state['search_executor'].shutdown(wait=False)
+    if app_state.get('index_stop'):
+        app_state['index_stop'].set()
+    if isinstance(app_state.get('local_index'), IVFIndex):
+        app_state['local_index'].close()
     app_state.clear()
 
 app = FastAPI(title="Vector Search API with Code Cleaning", lifespan=lifespan)
@@ -175,52 +321,125 @@ app = FastAPI(title="Vector Search API with Code Cleaning", lifespan=lifespan)
 class SearchRequest(BaseModel):
     query_code: Union[str, List[str]]
 
+SEARCH_PROPERTIES = ["title", "file_name", "code", "describe"]
+
+def _near_vector_query(vector):
+    # 缓存返回的是 float32 数组，发给 Weaviate 前转成列表
+    if hasattr(vector, 'tolist'):
+        vector = vector.tolist()
+    near_vec = {"vector": vector, "certainty": app_state['certainty']}
+    return (
+        app_state['client'].query
+        .get(app_state['class_name'], SEARCH_PROPERTIES)
+        .with_near_vector(near_vec)
+        .with_limit(app_state['top_k'])
+        .with_additional(["distance", "certainty"])
+    )
+
+def _single_query(vector):
+    resp = _near_vector_query(vector).do()
+    if "errors" in resp:
+        raise Exception(str(resp["errors"]))
+    return resp["data"]["Get"][app_state['class_name']]
+
+def _multi_get_query(vectors):
+    """把多个 near_vector 查询用别名打包进一个 GraphQL 请求，按输入顺序返回"""
+    builders = [_near_vector_query(vector).with_alias(f"q{i}") for i, vector in enumerate(vectors)]
+    resp = app_state['client'].query.multi_get(builders).do()
+    if "errors" in resp:
+        raise Exception(str(resp["errors"]))
+    get_data = resp["data"]["Get"]
+    return [get_data.get(f"q{i}") or [] for i in range(len(vectors))]
+
+def search_vectors(vectors):
+    """
+    按配置的检索后端查询所有向量，返回每个向量对应的结果列表（顺序与输入一致）
+    """
+    if not vectors:
+        return []
+    if app_state['search_backend'] in ('exact', 'ann'):
+        return app_state['local_index'].search(vectors, app_state['top_k'], app_state['certainty'])
+    if app_state['search_backend'] == 'multi_get':
+        chunk_size = max(1, app_state['multi_get_chunk_size'])
+        results = []
+        for start in range(0, len(vectors), chunk_size):
+            results.extend(_multi_get_query(vectors[start:start + chunk_size]))
+        return results
+    # threads: 每个向量一次请求，使用全局共享的线程池
+    return list(app_state['search_executor'].map(_single_query, vectors))
+
+async def clean_query(q: str) -> str:
+    """
+    超过阈值的查询先做规则预清洗，预清洗后仍超过 token 预算才交给 LLM 清洗
+    """
+    chat_model = app_state.get('chat_model')
+    # 规则预清洗和 tokenizer 计数是阻塞的 CPU 计算，放到线程池中运行
+    prepared, needs_llm = await run_in_threadpool(app_state['clean_policy'].prepare, q)
+    if needs_llm and chat_model:
+        print(f"Code length {len(q)} (pre-cleaned {len(prepared)}) exceeds clean budget. Applying LLM cleaning...")
+        return await clean_code_logic_async(prepared, chat_model, app_state['clean_semaphore'], app_state.get('clean_cache'))
+    return prepared
+
+async def prepare_query(q: str) -> List[str]:
+    """
+    返回该查询需要向量化的文本列表：通常只有一条；
+    chunk 模式下超过清洗预算的长代码不走 LLM，而是切分为多个窗口
+    """
+    if app_state['long_code_mode'] == 'chunk':
+        return await run_in_threadpool(chunk_query, q)
+    return [await clean_query(q)]
+
+def chunk_query(q: str) -> List[str]:
+    """chunk 模式的预清洗与分窗，都是 CPU 计算，由 prepare_query 放到线程池中调用"""
+    prepared, needs_llm = app_state['clean_policy'].prepare(q)
+    if needs_llm:
+        chunk_conf = app_state['chunk_conf']
+        return split_code_windows(
+            prepared,
+            window_chars=chunk_conf.get('window_chars', app_state['max_clean_threshold']),
+            overlap_chars=chunk_conf.get('overlap_chars', 200),
+            max_windows=chunk_conf.get('max_windows', 32)
+        )
+    return [prepared]
+
+async def prepare_queries(queries: List[str]) -> List[List[str]]:
+    """并发处理所有查询，返回顺序与输入一致"""
+    return list(await asyncio.gather(*(prepare_query(q) for q in queries)))
+
+def embed_and_search(text_groups: List[List[str]]) -> List[List[dict]]:
+    """
+    所有文本一次性向量化并检索，再按查询分组；多窗口的查询聚合为一个结果列表
+    """
+    flat_texts = [text for texts in text_groups for text in texts]
+    # 先查缓存，未命中的交给调度器与其他并发请求合并成一次批量 encode
+    vectors = app_state['embed_cache'].embed(flat_texts, app_state['embed_batcher'].embed)
+    flat_results = search_vectors(vectors)
+
+    results = []
+    offset = 0
+    for texts in text_groups:
+        group = flat_results[offset:offset + len(texts)]
+        offset += len(texts)
+        if len(group) == 1:
+            results.append(group[0])
+        else:
+            results.append(aggregate_window_matches(group, app_state['top_k'], app_state['chunk_conf'].get('aggregate', 'max')))
+    return results
+
 @app.post("/vector_search")
-def search_code(request: SearchRequest):
-    # 使用 def 而非 async def，因为 embedding 和 weaviate 客户端是阻塞的，FastAPI 会在线程池中运行
+async def search_code(request: SearchRequest):
+    # LLM 清洗走异步客户端并发执行；embedding 和 weaviate 客户端是阻塞的，放到线程池中运行
     try:
-        client = app_state['client']
-        embed_model = app_state['embed_model']
-        class_name = app_state['class_name']
-        chat_model = app_state.get('chat_model')
-        threshold = app_state.get('max_clean_threshold', 1200)
-
         # 归一化输入为列表
         queries = [request.query_code] if isinstance(request.query_code, str) else request.query_code
         if not queries:
             return {"message": "Empty query", "data": []}
 
-        # 应用代码清洗逻辑 (z.py logic)
-        cleaned_queries = []
-        for q in queries:
-            if len(q) > threshold and chat_model:
-                print(f"Code length {len(q)} exceeds threshold {threshold}. Applying cleaning...")
-                cleaned_q = clean_code_logic(q, chat_model)
-                cleaned_queries.append(cleaned_q)
-            else:
-                cleaned_queries.append(q)
-        query_vectors = embed_model.embed_documents(cleaned_queries)
-
-        # 定义单个查询函数
-        def _single_query(vector):
-            near_vec = {"vector": vector, "certainty": app_state['certainty']}
-            
-            resp = (
-                client.query
-                .get(class_name, ["title", "file_name", "code", "describe"])
-                .with_near_vector(near_vec)
-                .with_limit(app_state['top_k'])
-                .with_additional(["distance", "certainty"])
-                .do()
-            )
-            if "errors" in resp:
-                raise Exception(str(resp["errors"]))
-            return resp["data"]["Get"][class_name]
-
-        max_threads = min(len(query_vectors), app_state['max_threads'])
-        with ThreadPoolExecutor(max_workers=max_threads) as executor:
-            # map 返回的结果顺序与输入顺序一致
-            results_list = list(executor.map(_single_query, query_vectors))
+        # 应用代码清洗逻辑 (z.py logic)，多个查询并发清洗（chunk 模式下长代码切分为窗口）
+        text_groups = await prepare_queries(queries)
+
+        # 检索结果顺序与输入顺序一致
+        results_list = await run_in_threadpool(embed_and_search, text_groups)
         
         # 组装返回结果，包含原始输入代码
         formatted_results = []
@@ -242,6 +461,48 @@ def search_code(request: SearchRequest):
         print(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
+@app.post("/vector_search/stream")
+async def search_code_stream(request: SearchRequest):
+    """
+    流式版本：每个输入的检索结果一就绪就输出一行 NDJSON，输出顺序与完成顺序一致，
+    每行带 index 字段标明对应的输入位置。
+    """
+    queries = [request.query_code] if isinstance(request.query_code, str) else request.query_code
+    # 同一请求内同时处理的输入数上限，控制超大请求的内存占用
+    semaphore = asyncio.Semaphore(app_state.get('stream_concurrency', 16))
+
+    async def _process_one(index, q):
+        async with semaphore:
+            try:
+                texts = await prepare_query(q)
+                matches = (await run_in_threadpool(embed_and_search, [texts]))[0]
+                return {"index": index, "input_code": q, "records": matches}
+            except Exception as e:
+                print(f"Error processing stream item {index}: {e}")
+                return {"index": index, "input_code": q, "records": [], "error": str(e)}
+
+    async def _generate():
+        tasks = [asyncio.ensure_future(_process_one(i, q)) for i, q in enumerate(queries)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                item = await finished
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端断开时取消剩余任务
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(_generate(), media_type="application/x-ndjson")
+
+@app.get("/cache_stats")
+def cache_stats():
+    # 缓存命中率统计
+    clean_cache = app_state.get('clean_cache')
+    return {
+        "embed_cache": app_state['embed_cache'].stats(),
+        "clean_cache": clean_cache.stats() if clean_cache else None
+    }
+
 if __name__ == "__main__":
     # 读取配置启动服务
     config = load_config()
@@ -0,0 +1,164 @@
+'''
+后缀数组索引：回答 "哪些数据库代码片段包含输入" 的查询
+所有 format_code 以分隔符拼接为一个语料串，查询时在后缀数组上二分查找，
+耗时与 输入长度 * log(语料长度) + 命中数 成正比，与片段数量无关
+'''
+import json
+import os
+import shutil
+import tempfile
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+# 片段之间的分隔符，不会出现在去除空白后的代码中，保证匹配不会跨片段
+SEPARATOR = '\x00'
+# 索引目录下指向当前版本子目录的文件；每次保存写入新的版本目录再原子切换，
+# 从不覆盖正在被 mmap 的旧文件（截断已映射文件会导致读取方 SIGBUS）
+CURRENT_FILE = 'CURRENT'
+
+
+def build_suffix_array(corpus: str) -> np.ndarray:
+    """倍增法构造后缀数组，O(n log^2 n)，全部在 numpy 中完成"""
+    n = len(corpus)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    rank = np.frombuffer(corpus.encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    k = 1
+    while True:
+        second = np.full(n, -1, dtype=np.int64)
+        second[:n - k] = rank[k:]
+        sa = np.lexsort((second, rank))
+        first_sorted, second_sorted = rank[sa], second[sa]
+        changed = (first_sorted[1:] != first_sorted[:-1]) | (second_sorted[1:] != second_sorted[:-1])
+        new_rank = np.empty(n, dtype=np.int64)
+        new_rank[sa] = np.concatenate(([0], np.cumsum(changed)))
+        rank = new_rank
+        if rank.max() == n - 1 or k >= n:
+            return sa
+        k *= 2
+
+
+class SuffixIndex:
+    """
+    doc_starts[i] 为第 i 个片段在语料串中的起始位置，doc_ids[i] 为其数据库 id。
+    """
+
+    def __init__(self, corpus: str, suffix_array, doc_starts, doc_ids, signature=None):
+        self.corpus = corpus
+        self.suffix_array = suffix_array
+        self.doc_starts = doc_starts
+        self.doc_ids = doc_ids
+        self.signature = list(signature) if signature is not None else None
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @classmethod
+    def build(cls, documents: Iterable[Tuple[int, str]], signature=None):
+        doc_ids, doc_starts, parts = [], [], []
+        position = 0
+        for doc_id, code in documents:
+            if code is None:
+                continue
+            code = code.replace(SEPARATOR, '')
+            doc_ids.append(doc_id)
+            doc_starts.append(position)
+            parts.append(code)
+            position += len(code) + 1
+        corpus = SEPARATOR.join(parts) + SEPARATOR if parts else ''
+        return cls(
+            corpus,
+            build_suffix_array(corpus),
+            np.asarray(doc_starts, dtype=np.int64),
+            np.asarray(doc_ids, dtype=np.int64),
+            signature
+        )
+
+    def save(self, index_dir):
+        """写入新的版本目录后原子切换 CURRENT，再清理旧版本目录"""
+        os.makedirs(index_dir, exist_ok=True)
+        version_dir = tempfile.mkdtemp(prefix='v-', dir=index_dir)
+        with open(os.path.join(version_dir, 'corpus.txt'), 'w', encoding='utf-8', newline='') as f:
+            f.write(self.corpus)
+        np.save(os.path.join(version_dir, 'suffix_array.npy'), self.suffix_array)
+        np.save(os.path.join(version_dir, 'doc_starts.npy'), self.doc_starts)
+        np.save(os.path.join(version_dir, 'doc_ids.npy'), self.doc_ids)
+        with open(os.path.join(version_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'signature': self.signature, 'documents': len(self.doc_ids)}, f)
+
+        version = os.path.basename(version_dir)
+        fd, pointer_tmp = tempfile.mkstemp(prefix=CURRENT_FILE + '.', dir=index_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(version)
+        os.replace(pointer_tmp, os.path.join(index_dir, CURRENT_FILE))
+        _remove_stale_versions(index_dir, version)
+
+    @classmethod
+    def load(cls, index_dir):
+        with open(os.path.join(index_dir, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            version_dir = os.path.join(index_dir, f.read().strip())
+        with open(os.path.join(version_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(os.path.join(version_dir, 'corpus.txt'), 'r', encoding='utf-8', newline='') as f:
+            corpus = f.read()
+        return cls(
+            corpus,
+            np.load(os.path.join(version_dir, 'suffix_array.npy'), mmap_mode='r'),
+            np.load(os.path.join(version_dir, 'doc_starts.npy')),
+            np.load(os.path.join(version_dir, 'doc_ids.npy')),
+            meta.get('signature')
+        )
+
+    @classmethod
+    def load_or_build(cls, index_dir, documents_fn, signature):
+        """磁盘上的索引与当前表签名一致时直接加载，否则重建并保存"""
+        signature = list(signature)
+        if os.path.exists(os.path.join(index_dir, CURRENT_FILE)):
+            try:
+                index = cls.load(index_dir)
+                if index.signature == signature:
+                    return index
+            except Exception as e:
+                print(f"加载后缀数组索引失败，将重建: {e}")
+        index = cls.build(documents_fn(), signature)
+        index.save(index_dir)
+        return index
+
+    def _bound(self, pattern, strict):
+        """二分查找第一个前缀 >= pattern（strict 时为 > pattern）的后缀位置"""
+        corpus, sa, m = self.corpus, self.suffix_array, len(pattern)
+        lo, hi = 0, len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = int(sa[mid])
+            prefix = corpus[start:start + m]
+            if prefix < pattern or (strict and prefix == pattern):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def search(self, pattern: str) -> List[int]:
+        """返回包含 pattern 的所有片段 id（升序）"""
+        if SEPARATOR in pattern or len(self.doc_ids) == 0:
+            return []
+        if not pattern:
+            return sorted(int(i) for i in self.doc_ids)
+        lo, hi = self._bound(pattern, False), self._bound(pattern, True)
+        if lo >= hi:
+            return []
+        positions = np.asarray(self.suffix_array[lo:hi])
+        docs = np.unique(np.searchsorted(self.doc_starts, positions, side='right') - 1)
+        return sorted(int(i) for i in self.doc_ids[docs])
+
+
+def _remove_stale_versions(index_dir, keep):
+    """
+    删除旧版本目录。仍被其他索引对象 mmap 的文件在 POSIX 上删除后映射继续有效；
+    删除失败（如 Windows 上文件被占用）时留到下次保存再清理
+    """
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        if name != keep and name.startswith('v-') and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
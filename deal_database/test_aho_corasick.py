@@ -0,0 +1,23 @@
+'''
+aho_corasick 的回归测试：纯 Python 实现的结果与逐个子串判断一致
+'''
+import random
+
+from aho_corasick import AhoCorasick
+
+
+def test_python_backend_matches_brute_force():
+    rng = random.Random(0)
+    alphabet = "ab(){};中"
+    patterns = [(i, "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 6)))) for i in range(300)]
+    patterns += [(1000, "ab"), (1001, "ab")]  # 同一模式串对应多个 id
+    automaton = AhoCorasick(patterns, backend='python')
+    for _ in range(20):
+        text = "".join(rng.choice(alphabet) for _ in range(400))
+        expected = {pattern_id for pattern_id, pattern in patterns if pattern in text}
+        assert automaton.search(text) == expected
+        assert {pattern_id for _, pattern_id in automaton.iter_matches(text)} == expected
+
+
+def test_empty_automaton():
+    assert AhoCorasick([], backend='python').search("abc") == set()
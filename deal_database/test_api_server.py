@@ -0,0 +1,30 @@
+'''
+api_server 批量查询构造的回归测试：短输入（< 3 个字符）不能走 LIKE 分支
+'''
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("asyncpg")
+
+from api_server import build_batch_params, build_batch_search_sql, has_short_input
+
+
+def test_batch_params_leave_short_patterns_empty():
+    params = build_batch_params(["ab", "abcd%"], input_contains_db=False)
+    assert params["inputs"] == ["ab", "abcd%"]
+    assert params["patterns"] == [None, "%abcd\\%%"]
+
+
+def test_batch_sql_adds_strpos_arm_only_for_short_inputs():
+    long_codes = ["abcdef"]
+    mixed_codes = ["abcdef", "x"]
+    assert not has_short_input(long_codes)
+    assert has_short_input(mixed_codes)
+
+    long_sql = build_batch_search_sql("t", False, True, asyncpg_style=True, short_inputs=has_short_input(long_codes))
+    mixed_sql = build_batch_search_sql("t", False, True, asyncpg_style=True, short_inputs=has_short_input(mixed_codes))
+    assert "LIKE q.contains_pattern" in long_sql
+    assert "strpos" not in long_sql
+    assert "LIKE q.contains_pattern" in mixed_sql
+    assert "q.contains_pattern IS NULL AND strpos(m.format_code, q.input_code) > 0" in mixed_sql
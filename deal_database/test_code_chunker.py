@@ -0,0 +1,22 @@
+'''
+code_chunker 的回归测试：窗口数超过上限时要覆盖整段输入
+'''
+from code_chunker import split_code_windows
+
+
+def test_windows_cover_whole_input_when_capped():
+    code = "\n".join(f"  x{i} = {i};" for i in range(2000))
+    windows = split_code_windows(code, window_chars=200, overlap_chars=0, max_windows=8)
+    assert len(windows) == 8
+    assert windows[0].startswith("  x0 = 0;")
+    assert windows[-1].endswith("x1999 = 1999;")
+    # 中间窗口分布在整段输入上，而不是集中在开头
+    first_lines = [int(w.split()[0][1:]) for w in windows]
+    assert first_lines == sorted(first_lines)
+    assert 800 < first_lines[4] < 1200
+
+
+def test_short_input_keeps_all_windows():
+    code = "\n".join(f"  x{i} = {i};" for i in range(20))
+    windows = split_code_windows(code, window_chars=100, overlap_chars=0, max_windows=32)
+    assert "\n".join(windows).count(";") == 20
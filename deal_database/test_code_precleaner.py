@@ -0,0 +1,36 @@
+'''
+code_precleaner 的回归测试：声明剥离不能删除控制流语句
+'''
+from code_precleaner import preclean_code
+
+
+def test_keeps_return_and_goto_after_open_brace():
+    code = "\n".join([
+        "int f(int param_1)",
+        "{",
+        "  undefined4 uVar1;",
+        "  char *pcVar2;",
+        "  goto LAB_00401000;",
+        "}",
+        "int g(void)",
+        "{",
+        "  return uVar1;",
+        "}",
+    ])
+    cleaned = preclean_code(code)
+    assert "undefined4 uVar1;" not in cleaned
+    assert "char *pcVar2;" not in cleaned
+    assert "goto LAB_00401000;" in cleaned
+    assert "return uVar1;" in cleaned
+
+
+def test_keeps_statements_with_unknown_first_token():
+    code = "void f(void)\n{\n  uVar1 local_10;\n  break;\n}"
+    cleaned = preclean_code(code)
+    assert "uVar1 local_10;" in cleaned
+    assert "break;" in cleaned
+
+
+def test_keeps_address_names():
+    code = "void f(void)\n{\n  FUN_00401000(DAT_00403000);\n}"
+    assert "FUN_00401000(DAT_00403000);" in preclean_code(code)
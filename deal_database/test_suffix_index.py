@@ -0,0 +1,21 @@
+'''
+suffix_index 的回归测试：重建索引时不能破坏仍在服务的旧索引（mmap 的文件）
+'''
+from suffix_index import SuffixIndex
+
+
+def test_rebuild_while_old_index_is_queried(tmp_path):
+    index_dir = str(tmp_path / "suffix_index")
+    old_docs = [(1, "intmain(){return0;}"), (2, "voidf(){g();}")]
+    SuffixIndex.load_or_build(index_dir, lambda: old_docs, ["v1"])
+    old_index = SuffixIndex.load_or_build(index_dir, lambda: old_docs, ["v1"])
+    assert old_index.search("g();") == [2]
+
+    new_docs = [(3, "g();" * 5000), (4, "return0;")]
+    new_index = SuffixIndex.load_or_build(index_dir, lambda: new_docs, ["v2"])
+
+    # 旧索引仍可查询，结果不受重建影响
+    assert old_index.search("g();") == [2]
+    assert old_index.search("return0;") == [1]
+    assert new_index.search("g();") == [3]
+    assert SuffixIndex.load(index_dir).signature == ["v2"]
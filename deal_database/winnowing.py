@@ -0,0 +1,50 @@
+'''
+Winnowing 指纹（MOSS 风格）：对 k-gram 哈希序列做滑动窗口取最小值，
+相同代码片段得到相同指纹，局部改动（变量改名、OCR 错字）只影响附近少量指纹
+'''
+import hashlib
+import re
+from typing import List, Set
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_for_fingerprint(code: str) -> str:
+    """去除空白并统一小写，与 format_code 的归一化方式兼容"""
+    return WHITESPACE_RE.sub('', code or '').lower()
+
+
+def _kgram_hash(kgram: str) -> int:
+    # 取 blake2b 的 8 字节作为有符号 64 位整数，可直接存入 Postgres BIGINT
+    return int.from_bytes(hashlib.blake2b(kgram.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+def kgram_hashes(text: str, k: int) -> List[int]:
+    return [_kgram_hash(text[i:i + k]) for i in range(len(text) - k + 1)]
+
+
+def winnow(hashes: List[int], window: int) -> Set[int]:
+    """
+    每个长度为 window 的窗口中取最小哈希（并列时取最右一个），
+    只有当选中的位置变化时才记录一次指纹
+    """
+    if not hashes:
+        return set()
+    if len(hashes) <= window:
+        return {min(hashes)}
+    fingerprints = set()
+    last_pos = -1
+    for start in range(len(hashes) - window + 1):
+        window_hashes = hashes[start:start + window]
+        min_hash = min(window_hashes)
+        # 最右侧的最小值位置
+        pos = start + window - 1 - window_hashes[::-1].index(min_hash)
+        if pos != last_pos:
+            fingerprints.add(min_hash)
+            last_pos = pos
+    return fingerprints
+
+
+def fingerprint(code: str, k=8, window=4) -> Set[int]:
+    """返回代码的指纹集合；归一化后短于 k 的代码没有指纹"""
+    return winnow(kgram_hashes(normalize_for_fingerprint(code), k), window)
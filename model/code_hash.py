@@ -0,0 +1,18 @@
+import hashlib
+import re
+
+# 去空白规则：extract_*.py 生成 format_code、get_in_database.py 计算去重键都用这一份
+WHITESPACE_RE = re.compile(r'[\s\n]+')
+
+
+def strip_whitespace(code):
+    """去掉所有换行和空格，得到 format_code"""
+    return WHITESPACE_RE.sub('', code or '')
+
+
+def content_hash(file_name, format_code):
+    """
+    内容哈希：文件名 + 去空白代码，作为 JSONL 的 hash 字段和数据库 hash_str 唯一键。
+    get_in_database.py 迁移旧数据时的 SQL 表达式与这里保持一致
+    """
+    return hashlib.sha256(f"{file_name or ''}\n{format_code or ''}".encode('utf-8')).hexdigest()
@@ -3,8 +3,8 @@ from openai import OpenAI, AsyncOpenAI
 from typing import Any
 import re
 import json
-import hashlib
 from config import load_config
+from code_hash import content_hash, strip_whitespace
 from extract_prompt import (
     EXTRACT_CODE_SYSTEM_PROMPT,
     EXTRACT_CODE_USER_PROMPT,
@@ -155,7 +155,7 @@ def init_jsonl_file(output_file):
     with open(output_file, 'w', encoding='utf-8') as f:
         pass
 
-def main(hash = "hash"):
+def main():
     # 配置加载
     SETTINGS_FILE = "settings.yaml"
     config = load_config(SETTINGS_FILE)
@@ -234,7 +234,7 @@ def main(hash = "hash"):
                             continue
                         
                         # 生成format_code：去掉所有换行和空格
-                        format_code = re.sub(r'[\s\n]+', '', modified_code)
+                        format_code = strip_whitespace(modified_code)
 
                         # 生成代码描述
                         describe_content = llm_client.get_chat(
@@ -248,7 +248,7 @@ def main(hash = "hash"):
                             "code": modified_code.strip(), # 存储修正后的代码
                             "describe": describe_content,
                             "format_code": format_code,
-                            "hash": hash
+                            "hash": content_hash(md_file, format_code)
                         }
                         
                         # 立即写入JSONL文件
@@ -280,4 +280,4 @@ def main(hash = "hash"):
     print(f"   - 输出文件: {output_file}")
 
 if __name__ == "__main__":
-    main(hash = "hash")
+    main()